@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Osia authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Module implements installation of many clusters at once.
+
+The clusters are described by manifest file, every cluster is installed
+by one worker of bounded pool, number of concurrently installed clusters
+can be limited per cloud as well. Log of every cluster is written
+to its own file."""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Callable, Dict, List, TextIO
+
+import contextvars
+import logging
+import threading
+import time
+
+import yaml
+
+MANIFEST_KEYS = ['workers', 'log_dir', 'limits', 'defaults', 'clusters']
+WORKERS = 4
+LOG_DIR = "logs"
+LOG_FORMAT = "%(asctime)s %(filename)12s:%(lineno)-5i %(levelname)-8s %(message)s"
+
+Job = Callable[[Dict, TextIO], bool]
+
+_CLUSTER: contextvars.ContextVar = contextvars.ContextVar('osia_batch_cluster', default=None)
+
+
+class BatchException(Exception):
+    """BatchException represents invalid manifest of batch installation
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(self, *args, **kwargs)
+
+
+def load_manifest(manifest_file: str) -> Dict:
+    """Reads the manifest, every cluster gets the values from `defaults`
+    section unless it sets them itself"""
+    with open(manifest_file) as inp:
+        manifest = yaml.safe_load(inp) or {}
+    unknown = set(manifest.keys()) - set(MANIFEST_KEYS)
+    if unknown:
+        raise BatchException(f"Unknown keys in manifest: {', '.join(sorted(unknown))}")
+    clusters = []
+    for cluster in manifest.get('clusters') or []:
+        cluster = dict(manifest.get('defaults') or {}, **cluster)
+        if not cluster.get('cluster_name'):
+            raise BatchException("Every cluster in manifest must have cluster_name")
+        clusters.append({k: ','.join(v) if isinstance(v, list) else v
+                         for k, v in cluster.items()})
+    names = [k['cluster_name'] for k in clusters]
+    duplicates = {k for k in names if names.count(k) > 1}
+    if duplicates:
+        raise BatchException(f"Clusters defined more than once: {', '.join(sorted(duplicates))}")
+    manifest['clusters'] = clusters
+    return manifest
+
+
+class _ClusterFilter(logging.Filter):
+    """Passes only records logged while installing the cluster, the context
+    is propagated also to tasks started by the installation"""
+    # pylint: disable=too-few-public-methods
+    def __init__(self, cluster_name: str):
+        super().__init__()
+        self.cluster_name = cluster_name
+
+    def filter(self, record) -> bool:
+        return _CLUSTER.get() == self.cluster_name
+
+
+class BatchInstaller:
+    """Object runs the installation of clusters from manifest
+    and collects their results"""
+    def __init__(self, manifest: Dict):
+        self.clusters = manifest['clusters']
+        self.workers = int(manifest.get('workers') or WORKERS)
+        self.log_dir = Path(manifest.get('log_dir') or LOG_DIR)
+        self.limits = {cloud: threading.BoundedSemaphore(int(limit))
+                       for cloud, limit in (manifest.get('limits') or {}).items()}
+        self.results: List[Dict] = []
+
+    def _install(self, job: Job, cluster: Dict) -> Dict:
+        name = cluster['cluster_name']
+        log_file = self.log_dir / f"{name}.log"
+        result = {'cluster_name': name, 'cloud': cluster.get('cloud'),
+                  'result': 'failed', 'duration': 0.0, 'log': log_file.as_posix()}
+        handler = logging.FileHandler(log_file)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handler.addFilter(_ClusterFilter(name))
+        logging.getLogger().addHandler(handler)
+        token = _CLUSTER.set(name)
+        try:
+            with ExitStack() as stack:
+                limit = self.limits.get(cluster.get('cloud'))
+                if limit is not None:
+                    stack.enter_context(limit)
+                output = stack.enter_context(open(log_file, "a"))
+                logging.info("Starting installation of cluster %s", name)
+                start = time.monotonic()
+                try:
+                    if job(cluster, output):
+                        result['result'] = 'installed'
+                finally:
+                    result['duration'] = time.monotonic() - start
+                logging.info("Installation of cluster %s finished as %s",
+                             name, result['result'])
+        except Exception as err:  # pylint: disable=broad-except
+            logging.exception("Installation of cluster %s failed: %s", name, err)
+        finally:
+            _CLUSTER.reset(token)
+            logging.getLogger().removeHandler(handler)
+            handler.close()
+        return result
+
+    def run(self, job: Job) -> List[Dict]:
+        """Installs all clusters by the job and returns their results
+        in the order of the manifest"""
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        logging.info("Installing %d clusters by %d workers, logs are stored in %s",
+                     len(self.clusters), self.workers, self.log_dir)
+        with ThreadPoolExecutor(max_workers=self.workers,
+                                thread_name_prefix="osia-batch") as executor:
+            futures = [executor.submit(self._install, job, k) for k in self.clusters]
+            self.results = [k.result() for k in futures]
+        return self.results
+
+    def summary(self) -> str:
+        """Returns table with result and duration of every cluster"""
+        lines = [f"{'CLUSTER':30} {'CLOUD':12} {'RESULT':10} {'DURATION':>10}  LOG"]
+        for res in self.results:
+            minutes, seconds = divmod(int(res['duration']), 60)
+            lines.append(f"{res['cluster_name']:30} {res['cloud'] or '':12} "
+                         f"{res['result']:10} {minutes:>7}:{seconds:02}  {res['log']}")
+        return "\n".join(lines)
@@ -17,15 +17,23 @@
 openshift"""
 import argparse
 import logging
-from typing import List, Tuple, Optional
+import sys
+import threading
+import time
+from typing import Dict, List, Tuple, Optional
 from subprocess import Popen
 from semantic_version import Version, SimpleSpec
 import coloredlogs
 import distro
 
 from .config.config import ARCH_AMD, ARCH_ARM, ARCH_X86_64, ARCH_AARCH64, ARCH_S390X, ARCH_PPC
-from .installer import install_cluster, delete_cluster, storage, download_installer
+from .installer import install_cluster, delete_cluster, storage, download_installer_async
+from .installer import CacheManager
+from .installer.downloader.cache import parse_size
+from .installer.clouds.openstack import refill_pool
+from .installer.clients import AWSClients
 from .config import read_config
+from .batch import BatchException, BatchInstaller, load_manifest
 
 
 def _identity(in_attr: str) -> str:
@@ -58,6 +66,14 @@ ARGUMENTS = {
                                'action': 'store_true'},
         'osp_image_unique': {'help': 'Upload unique image per cluster',
                              'action': 'store_true'},
+        'osp_image_stream': {'help': 'Stream downloaded image directly into openstack, '
+                                     '`cache` keeps also copy in images directory',
+                             'nargs': '?', 'const': 'stream', 'choices': ['stream', 'cache']},
+        'osp_image_web_download': {'help': 'Let openstack download the image by web-download '
+                                           'import, glance must decompress imported images',
+                                   'action': 'store_true'},
+        'osp_fip_pool': {'help': 'Claim floating ips from reservoir filled by `osia pool refill`',
+                         'action': 'store_true'},
         'network_list': {'help': 'List of usable openstack networks, comma separated values',
                          'proc': _read_list},
         'worker_flavor': {'help': 'flavor of worker node'},
@@ -86,6 +102,9 @@ for a in [v for _, x in ARGUMENTS.items() for u, v in x.items()]:
     if not a.get('proc', None):
         a['proc'] = _identity
 
+_INSTALLERS: Dict[tuple, object] = {}
+_INSTALLERS_LOCK = threading.Lock()
+
 
 def _check_fips_compatible(rhel_version: bool) -> Tuple[bool, Optional[str]]:
     if not rhel_version:
@@ -121,12 +140,18 @@ def _resolve_installer(from_args):
             # fine to run normal installer on FIPS enabled RHEL
             from_args.enable_fips = False
 
-    return download_installer(from_args.installer_version,
-                              from_args.installer_arch,
-                              from_args.installers_dir,
-                              from_args.installer_source,
-                              rhel_version=rhel_version,
-                              fips=from_args.enable_fips)
+    # clusters installed by one batch share the download of the same installer
+    key = (from_args.installer_version, from_args.installer_arch, from_args.installers_dir,
+           from_args.installer_source, rhel_version, from_args.enable_fips)
+    with _INSTALLERS_LOCK:
+        if key not in _INSTALLERS:
+            _INSTALLERS[key] = download_installer_async(from_args.installer_version,
+                                                        from_args.installer_arch,
+                                                        from_args.installers_dir,
+                                                        from_args.installer_source,
+                                                        rhel_version=rhel_version,
+                                                        fips=from_args.enable_fips)
+        return _INSTALLERS[key]
 
 
 def _merge_dictionaries(from_args):
@@ -138,23 +163,56 @@ def _merge_dictionaries(from_args):
     return result
 
 
-def _exec_install_cluster(args):
+def _check_cluster_name(args):
+    if args.cluster_name is None:
+        raise Exception('Option cluster-name must be passed')
+
+
+def _exec_install_cluster(args, output=None) -> bool:
+    if vars(args).get('batch'):
+        return _exec_batch_install(args)
+    _check_cluster_name(args)
     conf = _merge_dictionaries(args)
     if not args.skip_git:
         storage.check_repository()
     logging.info('Starting the installer with cloud name %s', conf['cloud_name'])
-    install_cluster(
+    installed = install_cluster(
         conf['cloud_name'],
         conf['cluster_name'],
         conf['cloud'],
         conf['installer'],
-        dns_settings=conf['dns']
+        dns_settings=conf['dns'],
+        output=output,
+        installers_dir=args.installers_dir if args.installer is None else None
     )
     if not args.skip_git:
         storage.write_changes(conf['cluster_name'])
+    return installed
+
+
+def _batch_args(args, cluster: Dict) -> argparse.Namespace:
+    unknown = set(cluster.keys()) - set(vars(args).keys())
+    if unknown:
+        raise BatchException(f"Unknown options of cluster {cluster['cluster_name']}: "
+                             f"{', '.join(sorted(unknown))}")
+    return argparse.Namespace(**{**vars(args), **cluster, 'batch': None})
+
+
+def _exec_batch_install(args) -> bool:
+    batch = BatchInstaller(load_manifest(args.batch))
+    for cluster in batch.clusters:
+        _batch_args(args, cluster)
+    batch.run(lambda cluster, output: _exec_install_cluster(_batch_args(args, cluster), output))
+    print(batch.summary())
+    failed = [k['cluster_name'] for k in batch.results if k['result'] != 'installed']
+    if failed:
+        logging.error("Installation of clusters %s failed", ', '.join(failed))
+        sys.exit(1)
+    return True
 
 
 def _exec_delete_cluster(args):
+    _check_cluster_name(args)
     # cleanup of fips cluster can be done from anywhere
     args.enable_fips = None
 
@@ -163,12 +221,55 @@ def _exec_delete_cluster(args):
     if not args.skip_git:
         storage.check_repository()
 
-    delete_cluster(conf['cluster_name'], conf['installer'])
+    delete_cluster(conf['cluster_name'], conf['installer'], sweep=args.sweep)
+    CacheManager(args.installers_dir).unpin(conf['cluster_name'])
 
     if not args.skip_git:
         storage.delete_directory(conf['cluster_name'])
 
 
+def _format_size(size: int) -> str:
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def _cache_managers(args):
+    return [CacheManager(k, parse_size(args.budget) if vars(args).get('budget') else None)
+            for k in [args.installers_dir, args.images_dir]]
+
+
+def _exec_cache_stats(args):
+    for cache in _cache_managers(args):
+        entries = cache.stats()
+        total = sum(k['size'] for k in entries)
+        budget = _format_size(cache.budget) if cache.budget is not None else "unlimited"
+        print(f"{cache.directory}: {len(entries)} entries, {_format_size(total)} "
+              f"used, budget {budget}")
+        for entry in entries:
+            last_used = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry['atime']))
+            pinned = f"pinned by {', '.join(entry['pinned'])}" if entry['pinned'] else ""
+            print(f"  {entry['name']:40} {_format_size(entry['size']):>12} {last_used}  {pinned}")
+
+
+def _exec_cache_prune(args):
+    for cache in _cache_managers(args):
+        if cache.budget is None:
+            logging.error("No budget set for %s, use --budget or downloader.cache_budget",
+                          cache.directory)
+            continue
+        removed = cache.prune()
+        logging.info("Removed %d entries from %s", len(removed), cache.directory)
+
+
+def _exec_pool_refill(args):
+    allocated = refill_pool(args.osp_cloud, args.network_list, args.size)
+    for network, count in allocated.items():
+        logging.info("Allocated %d floating ips to reservoir of network %s", count, network)
+
+
 def _get_helper(parser: argparse.ArgumentParser):
     def printer(unused_conf):
         print("Operation not set, please specify either install or clean!")
@@ -177,10 +278,46 @@ def _get_helper(parser: argparse.ArgumentParser):
     return printer
 
 
+def _create_cache_parser(sub_parsers):
+    commons = argparse.ArgumentParser(add_help=False)
+    commons.add_argument('--installers-dir', help='Folder where installers are stored',
+                         default='installers')
+    commons.add_argument('--images-dir', help='Directory where images are stored',
+                         default='images')
+    commons.add_argument('-v', '--verbose', help='Increase verbosity level', action='store_true')
+
+    cache = sub_parsers.add_parser('cache', help='Manage cache of installers and images')
+    cache.set_defaults(func=lambda unused_conf: cache.print_help())
+    cache_parsers = cache.add_subparsers()
+    stats = cache_parsers.add_parser('stats', help='Show usage of the cache', parents=[commons])
+    stats.set_defaults(func=_exec_cache_stats)
+    prune = cache_parsers.add_parser('prune', help='Evict least recently used entries',
+                                     parents=[commons])
+    prune.add_argument('--budget', help='Size the cache should fit in, e.g. 20G, '
+                       'defaults to downloader.cache_budget from settings')
+    prune.set_defaults(func=_exec_cache_prune)
+
+
+def _create_pool_parser(sub_parsers):
+    pool = sub_parsers.add_parser('pool', help='Manage reservoir of openstack floating ips')
+    pool.set_defaults(func=lambda unused_conf: pool.print_help())
+    pool_parsers = pool.add_subparsers()
+    refill = pool_parsers.add_parser('refill', help='Allocate floating ips, until the reservoir '
+                                     'of every network has requested size')
+    refill.add_argument('--osp-cloud', required=True,
+                        help='Name of openstack cloud identity in clouds.yaml')
+    refill.add_argument('--network-list', required=True, type=_read_list,
+                        help='List of networks, comma separated values')
+    refill.add_argument('--size', type=int, default=4,
+                        help='Number of free floating ips kept in every network')
+    refill.add_argument('-v', '--verbose', help='Increase verbosity level', action='store_true')
+    refill.set_defaults(func=_exec_pool_refill)
+
+
 def _create_commons():
     commons = argparse.ArgumentParser(add_help=False)
     common_arguments = [
-        [['--cluster-name'], dict(required=True, help='Name of the cluster')],
+        [['--cluster-name'], dict(required=False, help='Name of the cluster')],
         [['--installer'], dict(required=False,
                                help='Executable binary of openshift install cli', default=None)],
         [['--installer-version'], dict(help='Version of downloader to be downloaded',
@@ -216,10 +353,17 @@ def _setup_parser():
     for arg, value in sorted({k: v for _, x in ARGUMENTS.items() for k, v in x.items()}.items()):
         install.add_argument(f"--{arg.replace('_', '-')}",
                              **{k: v for k, v in value.items() if k != 'proc'})
+    install.add_argument('--batch', help='Manifest with clusters to be installed concurrently, '
+                         'replaces --cluster-name')
     install.set_defaults(func=_exec_install_cluster)
 
     clean = sub_parsers.add_parser('clean', help='Remove cluster', parents=[commons])
+    clean.add_argument('--sweep', help='Delete openstack resources of the cluster in bulk '
+                       'before installer destroys the rest', action='store_true')
     clean.set_defaults(func=_exec_delete_cluster)
+
+    _create_cache_parser(sub_parsers)
+    _create_pool_parser(sub_parsers)
     return parser
 
 
@@ -244,4 +388,8 @@ def main_cli():
     for package in ["urllib3", "git"]:
         logging.getLogger(package).setLevel(logging.INFO)
 
-    args.func(args)
+    try:
+        args.func(args)
+    finally:
+        if AWSClients.instance().stats():
+            logging.debug('[aws] Clients constructed: %s', AWSClients.instance().stats())
@@ -1,3 +1,3 @@
 """Module provides access to configuration via Dynaconf"""
-from .config import read_config, settings
-__all__ = ['read_config', 'settings']
+from .config import read_config, settings, get_section, get_cache_dir
+__all__ = ['read_config', 'settings', 'get_section', 'get_cache_dir']
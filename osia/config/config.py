@@ -4,7 +4,9 @@ with command line arguments.
 """
 import argparse
 import logging
+import os
 import warnings
+from pathlib import Path
 from typing import Dict, Optional
 
 from dynaconf import Dynaconf
@@ -24,6 +26,21 @@ settings = Dynaconf(
 )
 
 
+def get_section(name: str) -> Dict:
+    """Returns section of settings.yaml as dictionary, if section
+    is not configured, empty dictionary is returned."""
+    return settings.as_dict().get(name.upper(), None) or {}
+
+
+def get_cache_dir() -> Path:
+    """Returns directory where osia keeps caches shared between runs,
+    it is `cache_dir` from settings.yaml or `$XDG_CACHE_HOME/osia`."""
+    cache_dir = settings.get('cache_dir', None)
+    if not cache_dir:
+        cache_dir = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'osia'
+    return Path(cache_dir)
+
+
 def _resolve_cloud_name(args: argparse.Namespace) -> Optional[Dict]:
     defaults = settings.as_dict()
 
@@ -18,9 +18,11 @@ required to full installation of cluster"""
 from .clouds import InstallerProvider
 from .dns import DNSProvider
 from .executor import install_cluster, delete_cluster
-from .downloader import download_installer
+from .downloader import download_installer, download_installer_async, CacheManager
 __all__ = ['InstallerProvider',
            'DNSProvider',
            'install_cluster',
            'delete_cluster',
-           'download_installer']
+           'download_installer',
+           'download_installer_async',
+           'CacheManager']
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Osia authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Module implements boto3 clients shared by the whole process.
+
+Construction of the client loads service models and resolves credentials,
+clients are therefore created once per service and region and reused
+by all threads."""
+from typing import Dict, Optional, Tuple
+
+import logging
+import threading
+
+import boto3
+
+
+class AWSClients:
+    """Factory of boto3 clients created from single session, counts
+    constructed clients. Class implements singleton design pattern."""
+    __instance: "AWSClients" = None
+    __lock = threading.Lock()
+
+    @classmethod
+    def instance(cls) -> "AWSClients":
+        """Method to obtain singleton instance."""
+        with cls.__lock:
+            if cls.__instance is None:
+                cls.__instance = cls()
+        return cls.__instance
+
+    def __init__(self):
+        self.session = None
+        self.clients: Dict[Tuple[str, Optional[str]], object] = {}
+        self.constructions: Dict[Tuple[str, Optional[str]], int] = {}
+        self.lock = threading.Lock()
+
+    def client(self, service: str, region: Optional[str] = None):
+        """Returns client of the service in region, session is not
+        thread safe, so clients are constructed under the lock"""
+        key = (service, region)
+        with self.lock:
+            if key not in self.clients:
+                if self.session is None:
+                    self.session = boto3.session.Session()
+                self.clients[key] = self.session.client(service, region_name=region)
+                self.constructions[key] = self.constructions.get(key, 0) + 1
+                logging.debug('[aws] Constructed %s client in %s', service, region or 'default')
+            return self.clients[key]
+
+    def stats(self) -> dict:
+        """Returns number of constructed clients by service"""
+        with self.lock:
+            result: Dict[str, int] = {}
+            for (service, _), count in self.constructions.items():
+                result[service] = result.get(service, 0) + count
+            return result
+
+
+def get_client(service: str, region: Optional[str] = None):
+    """Returns boto3 client shared by the process"""
+    return AWSClients.instance().client(service, region)
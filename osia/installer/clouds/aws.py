@@ -14,12 +14,38 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Module implements configuration object for aws installation"""
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+import contextvars
+import json
 import logging
-import boto3
+import time
 
+from osia.config import settings, get_cache_dir
+from osia.installer.clients import get_client
+from osia.installer.downloader.utils import file_lock, write_json
 from .base import AbstractInstaller
 
+MAX_VPCS = 5
+PROBE_WORKERS = 32
+REGION_TTL = 300
+RESERVATION_TTL = 7200
+REGIONS_FILE = "aws-regions.json"
+
+# Service quotas limiting the installation, by service and quota code
+QUOTAS = {
+    'vpcs': ('vpc', 'L-F678F1CE'),
+    'eips': ('ec2', 'L-0263D0A3'),
+    'nat_gateways': ('vpc', 'L-FE5A380F'),
+    'vcpus': ('ec2', 'L-1216C47A'),
+}
+# Quotas used when service quotas can't be read, None means unlimited
+DEFAULT_QUOTAS = {'vpcs': MAX_VPCS, 'eips': 5, 'nat_gateways': 5, 'vcpus': None}
+# Resources consumed by single cluster with default topology
+REQUIREMENTS = {'vpcs': 1, 'eips': 3, 'nat_gateways': 1, 'vcpus': 24}
+STANDARD_FAMILIES = ('a', 'c', 'd', 'h', 'i', 'm', 'r', 't', 'z')
+
 
 class AWSInstaller(AbstractInstaller):
     """Object containing all configuration related
@@ -36,7 +62,7 @@ class AWSInstaller(AbstractInstaller):
         return 'aws.jinja2'
 
     def acquire_resources(self):
-        region = get_free_region(self.list_of_regions)
+        region = get_free_region(self.list_of_regions, self.cluster_name)
 
         if region is None:
             logging.error("No free region amongst selected ones: %s",
@@ -45,26 +71,200 @@ class AWSInstaller(AbstractInstaller):
         logging.info("Selected region %s", region)
         self.cluster_region = region
 
+    def release_resources(self):
+        release_region(self.cluster_name, installed=False)
+
     def get_api_ip(self) -> Optional[str]:
         return None
 
     def get_apps_ip(self):
         return None
 
+    def stop_watching(self):
+        release_region(self.cluster_name, installed=False)
+
     def post_installation(self):
-        pass
+        release_region(self.cluster_name, installed=True)
+
+
+def _regions_file() -> Path:
+    return get_cache_dir() / REGIONS_FILE
+
+
+def _load_regions() -> Dict:
+    try:
+        with _regions_file().open() as inp:
+            return json.load(inp)
+    except (OSError, ValueError):
+        return {'regions': {}, 'reservations': {}}
+
+
+def _count_nat_gateways(client) -> int:
+    """Returns the highest number of nat gateways in single zone,
+    as the quota is applied per availability zone"""
+    subnets = [k['SubnetId']
+               for page in client.get_paginator('describe_nat_gateways').paginate(
+                   Filters=[{'Name': 'state', 'Values': ['pending', 'available']}])
+               for k in page['NatGateways']]
+    if not subnets:
+        return 0
+    zones = {k['SubnetId']: k['AvailabilityZone']
+             for k in client.describe_subnets(SubnetIds=list(set(subnets)))['Subnets']}
+    per_zone = [zones.get(k) for k in subnets]
+    return max(per_zone.count(k) for k in set(per_zone))
+
+
+def _count_vcpus(client) -> int:
+    """Returns number of vcpus of running standard on-demand instances"""
+    result = 0
+    for page in client.get_paginator('describe_instances').paginate(
+            Filters=[{'Name': 'instance-state-name', 'Values': ['pending', 'running']}]):
+        for instance in [k for res in page['Reservations'] for k in res['Instances']]:
+            if instance['InstanceType'].startswith(STANDARD_FAMILIES) and \
+                    instance.get('InstanceLifecycle') is None:
+                cpu = instance.get('CpuOptions', {})
+                result += cpu.get('CoreCount', 1) * cpu.get('ThreadsPerCore', 1)
+    return result
+
+
+USAGE = {
+    'vpcs': lambda client: len(client.describe_vpcs()['Vpcs']),
+    'eips': lambda client: len(client.describe_addresses()['Addresses']),
+    'nat_gateways': _count_nat_gateways,
+    'vcpus': _count_vcpus,
+}
 
 
-def get_free_region(order_list: List[str]) -> Optional[str]:
-    """Finds first free region in provided list,
-    if provided list is empty, it searches all regions"""
+def _get_quota(region: str, resource: str) -> Optional[float]:
+    service, code = QUOTAS[resource]
+    client = get_client('service-quotas', region)
+    try:
+        try:
+            return client.get_service_quota(ServiceCode=service, QuotaCode=code)['Quota']['Value']
+        except client.exceptions.NoSuchResourceException:
+            quota = client.get_aws_default_service_quota(ServiceCode=service, QuotaCode=code)
+            return quota['Quota']['Value']
+    except Exception as err:  # pylint: disable=broad-except
+        logging.debug("Unable to read quota %s in %s, using default: %s", code, region, err)
+        return DEFAULT_QUOTAS[resource]
+
+
+def _get_usage(region: str, resource: str) -> int:
+    return USAGE[resource](get_client('ec2', region))
+
+
+def _probe_regions(regions: List[str]) -> Dict[str, Dict]:
+    """Reads quotas and usage of all limiting resources in all regions at once,
+    regions which can't be probed are left out"""
+    result = {}
+    if not regions:
+        return result
+    calls = [(region, kind, resource) for region in regions
+             for kind in ('quotas', 'usage') for resource in QUOTAS]
+    with ThreadPoolExecutor(max_workers=min(PROBE_WORKERS, len(calls)),
+                            thread_name_prefix="osia-aws-probe") as executor:
+        probes = {'quotas': _get_quota, 'usage': _get_usage}
+        futures = [executor.submit(contextvars.copy_context().run,
+                                   probes[kind], region, resource)
+                   for region, kind, resource in calls]
+        failed = set()
+        for (region, kind, resource), future in zip(calls, futures):
+            try:
+                value = future.result()
+            except Exception as err:  # pylint: disable=broad-except
+                if region not in failed:
+                    logging.warning("Unable to probe region %s: %s", region, err)
+                failed.add(region)
+                continue
+            record = result.setdefault(region, {'quotas': {}, 'usage': {},
+                                                'fetched': time.time()})
+            record[kind][resource] = value
+    for region in failed:
+        result.pop(region, None)
+    for region, record in result.items():
+        logging.debug("Region %s uses %s of %s", region, record['usage'], record['quotas'])
+    return result
+
+
+def _headroom(record: Dict, reserved: int) -> float:
+    """Returns how many more clusters fit into the region, by the resource
+    with the least headroom"""
+    result = float('inf')
+    for resource, need in REQUIREMENTS.items():
+        quota = record['quotas'].get(resource)
+        if quota is None:
+            continue
+        free = quota - record['usage'][resource] - reserved * need
+        result = min(result, free // need)
+    return result
+
+
+def _all_regions(cache: Dict, now: float, ttl: float) -> List[str]:
+    """Returns names of all regions, the list is kept in the cache for ttl seconds"""
+    listed = cache.get('all_regions')
+    if listed is not None and now - listed['fetched'] < ttl:
+        return listed['names']
+    names = [v['RegionName'] for v in get_client('ec2').describe_regions()['Regions']]
+    cache['all_regions'] = {'names': names, 'fetched': now}
+    return names
+
+
+def get_free_region(order_list: List[str], cluster_name: Optional[str] = None) -> Optional[str]:
+    """Finds region with the most headroom in provided list,
+    if provided list is empty, it searches all regions.
+
+    Region qualifies when none of vpcs, elastic ips, nat gateways and vcpus
+    would exceed service quota by one more cluster, qualifying regions are ranked
+    by the number of clusters they can still fit, equal regions by the order of the list.
+
+    Quotas and usage of regions, as well as the list of all regions, are cached
+    in `aws-regions.json` of the cache directory for `aws_region_ttl` seconds,
+    only regions without fresh record are probed, all at once. Clusters being
+    installed reserve their region, so that concurrent installations don't count
+    on the same free resources."""
     candidates = order_list[:]
-    if len(candidates) == 0:
-        candidates = [v['RegionName'] for v in boto3.client('ec2').describe_regions()['Regions']]
-    for candidate in candidates:
-        region = boto3.client('ec2', candidate)
-        count = len(region.describe_vpcs()['Vpcs'])
-        if count < 5:
-            logging.debug("Selected region %s", candidate)
-            return candidate
-    return None
+    ttl = float(settings.get('aws_region_ttl', REGION_TTL))
+    with file_lock(_regions_file().with_suffix(".lock")):
+        cache = _load_regions()
+        now = time.time()
+        if len(candidates) == 0:
+            candidates = _all_regions(cache, now, ttl)
+        reservations = {k: v for k, v in cache['reservations'].items()
+                        if v['expires'] > now and k != cluster_name}
+        stale = [k for k in candidates if 'quotas' not in cache['regions'].get(k, {}) or
+                 now - cache['regions'][k]['fetched'] >= ttl]
+        logging.debug("Region cache hit for %d of %d regions",
+                      len(candidates) - len(stale), len(candidates))
+        cache['regions'].update(_probe_regions(stale))
+        scores = {}
+        for candidate in [k for k in candidates if 'quotas' in cache['regions'].get(k, {})]:
+            reserved = len([k for k in reservations.values() if k['region'] == candidate])
+            scores[candidate] = _headroom(cache['regions'][candidate], reserved)
+        ranked = sorted([k for k, v in scores.items() if v >= 1],
+                        key=lambda k: (-scores[k], candidates.index(k)))
+        result = ranked[0] if ranked else None
+        if result is not None:
+            logging.debug("Selected region %s, it fits %s more clusters", result, scores[result])
+        if result is not None and cluster_name is not None:
+            reservations[cluster_name] = {'region': result,
+                                          'reserved': now,
+                                          'expires': now + RESERVATION_TTL}
+        cache['reservations'] = reservations
+        write_json(_regions_file(), cache)
+    return result
+
+
+def release_region(cluster_name: str, installed: bool):
+    """Drops reservation of the region made by the cluster, when the cluster
+    was installed, its resources are added to cached usage of the region"""
+    with file_lock(_regions_file().with_suffix(".lock")):
+        cache = _load_regions()
+        reservation = cache['reservations'].pop(cluster_name, None)
+        if reservation is None:
+            return
+        record = cache['regions'].get(reservation['region'])
+        if installed and record is not None and 'usage' in record and \
+                record['fetched'] < reservation['reserved']:
+            for resource, need in REQUIREMENTS.items():
+                record['usage'][resource] += need
+        write_json(_regions_file(), cache)
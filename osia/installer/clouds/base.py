@@ -21,11 +21,12 @@ for specified installation platform"""
 import logging
 
 from abc import abstractmethod, ABC
-from subprocess import run
-from typing import ClassVar, Optional
+from typing import Callable, ClassVar, Optional
 from jinja2 import Environment, PackageLoader
 from semantic_version import Version, SimpleSpec
 
+from osia.installer.downloader.metadata import get_metadata
+
 
 class AbstractInstaller(ABC):
     """Base object for configuration of install-config"""
@@ -74,6 +75,10 @@ class AbstractInstaller(ABC):
         The method should be used to get all necessary dependencies to fill
         in details in install-config"""
 
+    def release_resources(self):
+        """Method called when the installation failed before the installer
+        started, it frees resources obtained by acquire_resources."""
+
     @abstractmethod
     def get_template_name(self):
         """Method to obtain name of jinja template related to specified platform."""
@@ -83,6 +88,15 @@ class AbstractInstaller(ABC):
         """Method called after the installation is done, this is the place where,
         things like registration of apps domain and other is expected to happen."""
 
+    def watch_installation(self, on_apps_ready: Callable[["AbstractInstaller"], None]):
+        """Method called right before the installer starts. Platform which can
+        make apps ip usable while the installer runs calls on_apps_ready
+        as soon as it happens."""
+
+    def stop_watching(self):
+        """Method called when the installation failed, it stops the work
+        started by watch_installation."""
+
     @abstractmethod
     def get_api_ip(self) -> Optional[str]:
         """Returns api ip address if dns is supported, None otherwise.
@@ -95,9 +109,7 @@ class AbstractInstaller(ABC):
 
     def _resolve_version(self):
         if self.ocp_version is None:
-            capture = run([self.installer, "version"], capture_output=True, check=False)
-            ver_string = capture.stdout.decode("utf-8").splitlines()[0].split(' ')[1]
-            self.ocp_version = ver_string
+            self.ocp_version = get_metadata(self.installer)['version']
             logging.info("Resolved installed version as %s", self.ocp_version)
 
     def _resolve_network_type(self):
@@ -115,7 +127,6 @@ class AbstractInstaller(ABC):
 
     def process_template(self):
         """Method executes creation of install-config.yaml"""
-        self._resolve_network_type()
         with open(self.pull_secret_file) as ps_file:
             self.pull_secret = ps_file.read()
         with open(self.ssh_key_file) as key_file:
@@ -123,6 +134,7 @@ class AbstractInstaller(ABC):
         if self.certificate_bundle_file is not None:
             with open(self.certificate_bundle_file) as cert_file:
                 self.certificate_bundle = cert_file.read()
+        self._resolve_network_type()
         template = AbstractInstaller.get_environment().get_template(self.get_template_name())
         result = template.render(self.__dict__)
         with open(f"{self.cluster_name}/install-config.yaml", "w") as yaml_file:
@@ -14,22 +14,52 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Module implements support for Openstack installation"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from operator import itemgetter
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import BinaryIO, Callable, Dict, Iterable, List, Optional, Tuple
 from os import path
 
+import contextvars
 import json
+import os
+import socket
+import threading
+import time
 import warnings
 import logging
 
 from openstack.connection import from_config, Connection
 from openstack.network.v2.floating_ip import FloatingIP
+from openstack.network.v2.network import Network
 from openstack.network.v2.port import Port
 from openstack.image.v2.image import Image
-from openstack.exceptions import SDKException
+from openstack.exceptions import SDKException, NotFoundException, PreconditionFailedException
+from openstack.exceptions import raise_from_response
 from osia.installer.clouds.base import AbstractInstaller
-from osia.installer.downloader import get_url, download_image
+from osia.installer.downloader import get_url, get_image_file, open_image
+from osia.installer.downloader.utils import file_lock
+from osia.installer.tasks import TaskGraph
+
+
+IMPORT_TIMEOUT = 3600
+LEASE_TIMEOUT = 3600
+CLUSTER_TAG = "osia-cluster:"
+PENDING_STATES = ['queued', 'saving', 'uploading', 'importing']
+SWEEP_WORKERS = 8
+SWEEP_TIMEOUT = 600
+INGRESS_POLL = 15
+LOOKUP_WORKERS = 8
+AVAILABILITY_TTL = 60
+POOL_TAG = "osia-pool"
+FIP_PURPOSES = ["api", "ingress"]
+
+_JSON_LOCK = threading.Lock()
+_CONNECTIONS: Dict[str, Connection] = {}
+_CONNECTIONS_LOCK = threading.Lock()
+_AVAILABILITY: Dict[str, Tuple[float, float]] = {}
+_AVAILABILITY_LOCK = threading.Lock()
 
 
 class ImageException(Exception):
@@ -41,31 +71,66 @@ class ImageException(Exception):
 
 
 def _load_connection_openstack(conn_name: str, args=None) -> Connection:
-    connection = from_config(cloud=conn_name, options=args)
-    if connection is None:
-        raise Exception(f"Unable to connect to ${conn_name}")
-    return connection
-
-
-def _update_json(json_file: str, fip: str):
-    res = None
-    with open(json_file) as inp:
-        res = json.load(inp)
-
-    res['fips'].append(fip)
-    with open(json_file, "w") as out:
-        json.dump(res, out)
+    """Returns connection to the cloud, connections without additional
+    options are shared by all operations of the process"""
+    with _CONNECTIONS_LOCK:
+        if args is None and conn_name in _CONNECTIONS:
+            return _CONNECTIONS[conn_name]
+        connection = from_config(cloud=conn_name, options=args)
+        if connection is None:
+            raise Exception(f"Unable to connect to ${conn_name}")
+        if args is None:
+            _CONNECTIONS[conn_name] = connection
+        return connection
+
+
+def _update_json(json_file: str, cloud: str, fip: Optional[str] = None,
+                 image: Optional[str] = None):
+    """Records floating ip or image, which are removed together with the cluster.
+    Resources are acquired concurrently, so the updates are serialized."""
+    with _JSON_LOCK:
+        res = {'cloud': cloud, 'fips': []}
+        if path.exists(json_file):
+            with open(json_file) as inp:
+                res = json.load(inp)
+        if fip is not None:
+            res['fips'].append(fip)
+        if image is not None:
+            res['image'] = image
+        with open(json_file, "w") as out:
+            json.dump(res, out)
+
+
+def _map(executor: ThreadPoolExecutor, func: Callable, items: Iterable) -> List:
+    """Works as executor.map, every call runs in its own copy of the caller's
+    context, so records logged by the calls reach the log of the cluster"""
+    futures = [executor.submit(contextvars.copy_context().run, func, k) for k in items]
+    return [k.result() for k in futures]
 
 
 def delete_fips(fips_file: str):
-    """Deletes floating ips stored in configuration file"""
+    """Deletes floating ips stored in configuration file.
+
+    Floating ips of the cluster are found by queries filtered by description
+    given to them at allocation, addresses not found this way are queried
+    by the address. Only addresses recorded in the file are released,
+    concurrently."""
     fips = None
     with open(fips_file) as fi_file:
         fips = json.load(fi_file)
+    cluster_name = Path(fips_file).parent.name
+    recorded = set(fips['fips'])
     connection = _load_connection_openstack(fips['cloud'])
-    os_fips = [j for k in fips['fips'] for j in connection.network.ips(floating_ip_address=k)]
-    for i in os_fips:
-        connection.network.delete_ip(i)
+    with ThreadPoolExecutor(max_workers=LOOKUP_WORKERS, thread_name_prefix="osia-fips") as executor:
+        found = _map(executor,
+                     lambda k: list(connection.network.ips(description=f"{cluster_name}-{k}")),
+                     FIP_PURPOSES)
+        os_fips = {k.floating_ip_address: k for j in found for k in j
+                   if k.floating_ip_address in recorded}
+        found = _map(executor, lambda k: list(connection.network.ips(floating_ip_address=k)),
+                     recorded - set(os_fips))
+        os_fips.update({k.floating_ip_address: k for j in found for k in j})
+        _map(executor, lambda k: _release_ip(connection, k), os_fips.values())
 
 
 def delete_image(fips_file, cluster_name):
@@ -79,39 +144,156 @@ def delete_image(fips_file, cluster_name):
     if fips.get('image', None) is None:
         return
     connection = _load_connection_openstack(fips['cloud'])
-    image = connection.image.find_image(fips['image'])
-    clusters = image.properties['osia_clusters'].split(',')
-    clusters.remove(cluster_name)
-    if len(clusters) == 0:
+    image = connection.image.find_image(fips['image'], ignore_missing=True)
+    if image is None:
+        logging.info("Image %s was already removed", fips['image'])
+        return
+    logging.info("Removing cluster %s from image %s metadata", cluster_name, image.name)
+    if _cluster_tag(cluster_name) in (image.tags or []):
+        connection.image.remove_tag(image, _cluster_tag(cluster_name))
+    legacy = [k for k in (image.properties or {}).get('osia_clusters', '').split(',') if k]
+    if cluster_name in legacy:
+        legacy.remove(cluster_name)
+        connection.image.update_image(image, osia_clusters=','.join(legacy))
+    image = connection.image.get_image(image)
+    if len(_image_clusters(image)) == 0:
         logging.info("Deleting uploaded image %s, since all clusters were removed", image.name)
         connection.image.delete_image(image)
-    else:
-        logging.info("Removing cluster %s from image %s metadata", cluster_name, image.name)
-        connection.image.update_image(image, osia_clusters=','.join(clusters))
+
+
+def _sweep(kind: str, resources: List, delete: Callable) -> int:
+    if len(resources) == 0:
+        return 0
+    logging.info("Sweeping %d %s", len(resources), kind)
+    deleted = 0
+    with ThreadPoolExecutor(max_workers=SWEEP_WORKERS, thread_name_prefix="osia-sweep") as executor:
+        futures = [(k, executor.submit(contextvars.copy_context().run, delete, k))
+                   for k in resources]
+        for resource, future in futures:
+            try:
+                future.result()
+                deleted += 1
+            except SDKException as err:
+                logging.debug("Unable to delete %s %s: %s", kind, resource.id, err)
+    return deleted
+
+
+# pylint: disable=too-many-locals
+def sweep_cluster(fips_file, cluster_name):
+    """Function deletes openstack resources of the cluster ahead of
+    installer's destroy, which removes them one by one.
+
+    Resources are found by infraID of the cluster, load balancers, servers,
+    ports, volumes and security groups are deleted in this order,
+    resources of each kind concurrently. Whatever is left is removed
+    by the installer."""
+    infra_id = _get_infra_id(cluster_name)
+    if infra_id is None:
+        logging.info("Metadata of cluster %s not found, nothing to sweep", cluster_name)
+        return
+    with open(fips_file) as inp:
+        cloud = json.load(inp)['cloud']
+    connection = _load_connection_openstack(cloud)
+    tag = f"openshiftClusterID={infra_id}"
+
+    def delete_server(server):
+        connection.compute.delete_server(server, ignore_missing=True)
+        connection.compute.wait_for_delete(server, wait=SWEEP_TIMEOUT)
+
+    stages = [
+        ('load balancers',
+         lambda: [k for k in connection.load_balancer.load_balancers()
+                  if (k.name or '').startswith(f"kube_service_{infra_id}_")],
+         lambda k: connection.load_balancer.delete_load_balancer(k, ignore_missing=True,
+                                                                 cascade=True)),
+        ('servers',
+         lambda: list(connection.compute.servers(name=f"^{infra_id}-")),
+         delete_server),
+        ('ports',
+         lambda: [k for k in connection.network.ports(tags=tag)
+                  if not (k.device_owner or '').startswith('network:')],
+         lambda k: connection.network.delete_port(k, ignore_missing=True)),
+        ('volumes',
+         lambda: [k for k in connection.block_storage.volumes()
+                  if (k.metadata or {}).get('cinder.csi.openstack.org/cluster') == infra_id],
+         lambda k: connection.block_storage.delete_volume(k, ignore_missing=True)),
+        ('security groups',
+         lambda: list(connection.network.security_groups(tags=tag)),
+         lambda k: connection.network.delete_security_group(k, ignore_missing=True)),
+    ]
+    for kind, find, delete in stages:
+        try:
+            resources = find()
+        except SDKException as err:
+            logging.debug("Unable to list %s: %s", kind, err)
+            continue
+        deleted = _sweep(kind, resources, delete)
+        logging.debug("Swept %d of %d %s of %s", deleted, len(resources), kind, infra_id)
 
 
 def _find_best_fit(networks: dict) -> str:
     return max(networks.items(), key=itemgetter(1))[0]
 
 
+def _find_network(osp_connection: Connection, name: str) -> Optional[Network]:
+    network = next(iter(osp_connection.network.networks(name=name)), None)
+    if network is None:
+        logging.warning("Network %s was not found", name)
+    return network
+
+
+def _get_network_fitness(osp_connection: Connection, network_id: str) -> float:
+    """Returns ratio of total and used ips of the network, the value is cached
+    for short time, so clusters installed at once don't ask repeatedly"""
+    with _AVAILABILITY_LOCK:
+        cached = _AVAILABILITY.get(network_id)
+    if cached is not None and time.monotonic() - cached[0] < AVAILABILITY_TTL:
+        return cached[1]
+    net_avail = osp_connection.network.get_network_ip_availability(network_id)
+    subnet_usage = [(subnet['total_ips'], subnet['used_ips'])
+                    for subnet in net_avail.subnet_ip_availability if subnet['ip_version'] == 4]
+    total_ips, used_ips = [sum(i) for i in zip(*subnet_usage)]
+    with _AVAILABILITY_LOCK:
+        _AVAILABILITY[network_id] = (time.monotonic(), total_ips / used_ips)
+    return total_ips / used_ips
+
+
 def _find_fit_network(osp_connection: Connection,
                       networks: List[str]) -> Tuple[Optional[str], Optional[str]]:
-    named_networks = {k['name']: k for k in osp_connection.list_networks() if k['name'] in networks}
-    results = {}
-    for net_name in networks:
-        net_avail = osp_connection.network.get_network_ip_availability(named_networks[net_name].id)
-        subnet_usage = [(subnet['total_ips'], subnet['used_ips'])
-                        for subnet in net_avail.subnet_ip_availability if subnet['ip_version'] == 4]
-        total_ips, used_ips = [sum(i) for i in zip(*subnet_usage)]
-        results[net_name] = total_ips / used_ips
+    with ThreadPoolExecutor(max_workers=LOOKUP_WORKERS,
+                            thread_name_prefix="osia-network") as executor:
+        found = _map(executor, lambda k: _find_network(osp_connection, k), networks)
+        named_networks = {k: v for k, v in zip(networks, found) if v is not None}
+        fitness = _map(executor, lambda k: _get_network_fitness(osp_connection, k.id),
+                       named_networks.values())
+        results = dict(zip(named_networks.keys(), fitness))
+    if len(results) == 0:
+        return None, None
     result = _find_best_fit(results)
-    return named_networks[result]['id'], result
+    return named_networks[result].id, result
+
+
+def _get_infra_id(cluster_name: str) -> Optional[str]:
+    """Returns infraID of the cluster, it is known once the installer
+    has written metadata of the cluster"""
+    metadata_file = Path(cluster_name) / "metadata.json"
+    try:
+        with open(metadata_file) as inp:
+            return json.load(inp)['infraID']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _find_ingress_port(osp_connection: Connection, cluster_name: str) -> Optional[Port]:
+    infra_id = _get_infra_id(cluster_name)
+    if infra_id is None:
+        logging.debug("Metadata of cluster %s not available yet", cluster_name)
+        return None
+    return next(iter(osp_connection.network.ports(name=f"{infra_id}-ingress-port")), None)
 
 
 def _find_cluster_ports(osp_connection: Connection, cluster_name: str) -> Port:
-    port_list = [k for k in osp_connection.list_ports()
-                 if k.name.startswith(cluster_name) and k.name.endswith('ingress-port')]
-    port = next(iter(port_list), None)
+    port = _find_ingress_port(osp_connection, cluster_name)
     if port is None:
         raise Exception(f"Ingress port for cluster {cluster_name} was not found")
     return port
@@ -121,60 +303,278 @@ def _attach_fip_to_port(osp_connection: Connection, fip_addr, ingress_port):
     osp_connection.network.add_ip_to_port(ingress_port, fip_addr)
 
 
+def _claim_pooled_ip(osp_connection: Connection,
+                     network_id: str,
+                     description: str) -> Optional[FloatingIP]:
+    """Claims free floating ip from the reservoir, concurrent claims
+    are resolved by compare-and-swap update of the description"""
+    for fip in osp_connection.network.ips(tags=POOL_TAG, floating_network_id=network_id):
+        if fip.description != POOL_TAG or fip.port_id is not None:
+            continue
+        try:
+            return osp_connection.network.update_ip(fip, if_revision=fip.revision_number,
+                                                    description=description)
+        except (PreconditionFailedException, NotFoundException):
+            logging.debug("Floating ip %s was claimed by another run", fip.floating_ip_address)
+    return None
+
+
+def _release_ip(osp_connection: Connection, fip: FloatingIP):
+    """Returns floating ip back to the reservoir, ips allocated
+    outside of the reservoir are deleted"""
+    if POOL_TAG in (fip.tags or []):
+        logging.debug("Returning floating ip %s to reservoir", fip.floating_ip_address)
+        osp_connection.network.update_ip(fip, port_id=None, description=POOL_TAG)
+    else:
+        osp_connection.network.delete_ip(fip)
+
+
+def _allocate_pooled_ip(osp_connection: Connection, network_id: str) -> FloatingIP:
+    fip = osp_connection.network.create_ip(floating_network_id=network_id,
+                                           description=POOL_TAG)
+    try:
+        osp_connection.network.set_tags(fip, [POOL_TAG])
+    except SDKException:
+        osp_connection.network.delete_ip(fip)
+        raise
+    return fip
+
+
+def refill_pool(cloud: str, networks: List[str], size: int) -> Dict[str, int]:
+    """Function allocates floating ips, so the reservoir of every network
+    has at least size free ips. Returns number of allocated ips by network."""
+    connection = _load_connection_openstack(cloud)
+    result = {}
+    with ThreadPoolExecutor(max_workers=LOOKUP_WORKERS, thread_name_prefix="osia-pool") as executor:
+        for name in networks:
+            network = _find_network(connection, name)
+            if network is None:
+                continue
+            free = [k for k in connection.network.ips(tags=POOL_TAG, floating_network_id=network.id)
+                    if k.description == POOL_TAG and k.port_id is None]
+            missing = max(size - len(free), 0)
+            logging.info("Reservoir of network %s has %d free floating ips, allocating %d",
+                         name, len(free), missing)
+            futures = [executor.submit(contextvars.copy_context().run,
+                                       _allocate_pooled_ip, connection, network.id)
+                       for _ in range(missing)]
+            result[name] = 0
+            for future in futures:
+                try:
+                    future.result()
+                    result[name] += 1
+                except SDKException as err:
+                    logging.error("Allocation of floating ip in network %s failed: %s", name, err)
+    return result
+
+
+# pylint: disable=too-many-arguments
 def _get_floating_ip(osp_connection: Connection,
                      cloud: str,
                      network_id: str,
                      cluster_name: str,
-                     purpose: str) -> FloatingIP:
-    fip = osp_connection.network.create_ip(floating_network_id=network_id,
-                                           description=f"{cluster_name}-{purpose}")
+                     purpose: str,
+                     pool: bool = False) -> FloatingIP:
+    fip = None
+    if pool:
+        fip = _claim_pooled_ip(osp_connection, network_id, f"{cluster_name}-{purpose}")
+        if fip is None:
+            logging.info("Reservoir of floating ips in network %s is empty", network_id)
+    if fip is None:
+        fip = osp_connection.network.create_ip(floating_network_id=network_id,
+                                               description=f"{cluster_name}-{purpose}")
     if fip is None:
         raise Exception(f"Allocation of Ip failed for network ${network_id}")
 
-    if path.exists(f"{cluster_name}/fips.json"):
-        _update_json(f"{cluster_name}/fips.json", fip.floating_ip_address)
-    else:
-        with open(f"{cluster_name}/fips.json", "w") as fips:
-            conf = {'cloud': cloud, 'fips': [fip.floating_ip_address]}
-            json.dump(conf, fips)
+    _update_json(f"{cluster_name}/fips.json", cloud, fip=fip.floating_ip_address)
     return fip
 
 
+def _cluster_tag(cluster_name: str) -> str:
+    return CLUSTER_TAG + cluster_name
+
+
+def _image_clusters(image: Image) -> List[str]:
+    """Returns clusters using the image, both from tags and from
+    `osia_clusters` property written by older versions of osia"""
+    tagged = [k[len(CLUSTER_TAG):] for k in image.tags or [] if k.startswith(CLUSTER_TAG)]
+    legacy = [k for k in (image.properties or {}).get('osia_clusters', '').split(',') if k]
+    return tagged + legacy
+
+
 def add_cluster(osp_connection: Connection, image: Image, cluster_name: str):
-    """Function adds cluster name to image metadata in order to prevent
+    """Function adds cluster tag to the image in order to prevent
     image deletion"""
-    clusters = image.properties['osia_clusters'].split(',')
-    clusters.append(cluster_name)
-    osp_connection.image.update_image(image, osia_clusters=','.join(clusters))
+    osp_connection.image.add_tag(image, _cluster_tag(cluster_name))
+
+
+def _web_download_supported(osp_connection: Connection) -> bool:
+    try:
+        methods = osp_connection.image.get_import_info().import_methods or {}
+    except SDKException as err:
+        logging.debug("Unable to obtain image import methods: %s", err)
+        return False
+    return 'web-download' in methods.get('value', [])
+
+
+def _wait_for_image(osp_connection: Connection, image: Image) -> Image:
+    deadline = time.monotonic() + IMPORT_TIMEOUT
+    delay = 2.0
+    while True:
+        image = osp_connection.image.get_image(image)
+        if image.status == 'active':
+            return image
+        if image.status in ['killed', 'deleted'] or \
+                (image.properties or {}).get('os_glance_failed_import'):
+            raise ImageException(f"Upload of image {image.name} failed")
+        if time.monotonic() > deadline:
+            raise ImageException(f"Upload of image {image.name} did not finish in time")
+        logging.debug("Image %s is %s, checking again in %.0fs", image.name, image.status, delay)
+        time.sleep(delay)
+        delay = min(delay * 2, 30.0)
+
+
+def _check_imported(image: Image) -> Image:
+    """Glance imports the compressed image as it is, unless its decompression
+    plugin is enabled. Such image has no virtual size, as it isn't recognized
+    as qcow2, and it must not be used."""
+    if not image.virtual_size:
+        raise ImageException(f"Imported image {image.name} is not valid qcow2, glance must "
+                             "decompress imported images to use web-download")
+    return image
+
+
+def _image_age(image: Image) -> float:
+    created = datetime.fromisoformat(image.created_at.replace('Z', '+00:00'))
+    return (datetime.now(timezone.utc) - created).total_seconds()
+
+
+def _create_record(osp_connection: Connection, image_name: str, cluster_name: str) -> Image:
+    """Creates image without data, the image stays in `queued` state
+    until the data are uploaded"""
+    return osp_connection.image.create_image(image_name, container_format="bare",
+                                             disk_format="qcow2", visibility='private',
+                                             tags=[_cluster_tag(cluster_name)],
+                                             allow_duplicates=True,
+                                             osia_lease=f"{socket.gethostname()}:{os.getpid()}")
+
+
+def _put_data(osp_connection: Connection, image: Image, data: BinaryIO):
+    image.data = data
+    raise_from_response(image.upload(osp_connection.image))
+
+
+def _fill_image(osp_connection: Connection,
+                image: Image,
+                images_dir: str,
+                installer: str,
+                mode: str = None) -> Image:
+    """Function uploads rhcos image into the image record.
+
+    By default the image is downloaded to images directory and uploaded
+    from there, the mode changes how the image gets into openstack:
+    `stream` sends the image directly from the download, `cache` does
+    the same and stores the image also to images directory and `web-download`
+    lets openstack download the image itself via image import.
+    The record is deleted when the upload fails or the imported image
+    is not usable."""
+    inst_url, version = get_url(installer)
+    image_path = Path(images_dir).joinpath(f"rhcos-{version}.qcow2")
+    if mode == 'web-download' and not _web_download_supported(osp_connection):
+        logging.warning("Openstack doesn't support web-download import, uploading image")
+        mode = None
+    try:
+        if mode == 'web-download':
+            logging.info("Starting import of image %s by openstack", inst_url)
+            osp_connection.image.import_image(image, method='web-download', uri=inst_url)
+        elif mode in ['stream', 'cache'] and not image_path.exists():
+            logging.info("Starting upload of image %s streamed into openstack", inst_url)
+            cache_file = image_path.as_posix() if mode == 'cache' else None
+            with open_image(inst_url, cache_file) as data:
+                _put_data(osp_connection, image, data)
+        else:
+            image_file = get_image_file(inst_url, version, images_dir)
+            logging.info("Starting upload of image into openstack")
+            with open(image_file, 'rb') as data:
+                _put_data(osp_connection, image, data)
+        image = _wait_for_image(osp_connection, image)
+        if mode == 'web-download':
+            image = _check_imported(image)
+    except Exception:
+        osp_connection.image.delete_image(image, ignore_missing=True)
+        raise
+    logging.info("Image uploaded as %s", image.name)
+    return image
 
 
+# pylint: disable=too-many-arguments
+def _upload_image(osp_connection: Connection,
+                  image_name: str,
+                  cluster_name: str,
+                  images_dir: str,
+                  installer: str,
+                  mode: str = None) -> Image:
+    image = _create_record(osp_connection, image_name, cluster_name)
+    return _fill_image(osp_connection, image, images_dir, installer, mode)
+
+
+# pylint: disable=too-many-arguments
+def _shared_image(osp_connection: Connection,
+                  image_name: str,
+                  cluster_name: str,
+                  images_dir: str,
+                  installer: str,
+                  mode: str = None) -> Image:
+    """Function returns active shared image, only one of concurrent runs
+    uploads it.
+
+    The image record in `queued` state works as a lease, runs which find
+    the record wait until it becomes active. If several runs create the record
+    at once, the oldest one wins and the other records are removed.
+    Records not finished within the lease timeout are considered abandoned."""
+    delay = 2.0
+    while True:
+        images = sorted(osp_connection.image.images(name=image_name),
+                        key=lambda k: (k.created_at, k.id))
+        active = [k for k in images if k.status == 'active']
+        if active:
+            logging.info("Reusing found image in openstack %s", image_name)
+            return active[0]
+        leases = []
+        for image in images:
+            if image.status == 'killed' or \
+                    (image.status in PENDING_STATES and _image_age(image) > LEASE_TIMEOUT):
+                logging.warning("Removing abandoned image %s in state %s", image.id, image.status)
+                osp_connection.image.delete_image(image, ignore_missing=True)
+            elif image.status in PENDING_STATES:
+                leases.append(image)
+        if len(leases) == 0:
+            image = _create_record(osp_connection, image_name, cluster_name)
+            leader = min((k for k in osp_connection.image.images(name=image_name)
+                          if k.status in PENDING_STATES + ['active']),
+                         key=lambda k: (k.created_at, k.id))
+            if leader.id == image.id:
+                return _fill_image(osp_connection, image, images_dir, installer, mode)
+            osp_connection.image.delete_image(image, ignore_missing=True)
+            continue
+        logging.info("Image %s is being uploaded by %s, waiting", image_name,
+                     (leases[0].properties or {}).get('osia_lease', leases[0].id))
+        time.sleep(delay)
+        delay = min(delay * 2, 30.0)
+
+
+# pylint: disable=too-many-arguments
 def upload_uniq_image(osp_connection: Connection,
                       cloud: str,
                       cluster_name: str,
                       images_dir: str,
-                      installer: str):
+                      installer: str,
+                      mode: str = None):
     """Function uploads unique image to the cluster, instead of making shared one"""
-    inst_url, version = get_url(installer)
+    _, version = get_url(installer)
     image_name = f"osia-{cluster_name}-{version}"
-    image_path = Path(images_dir).joinpath(f"rhcos-{version}.qcow2")
-    image_file = None
-    if image_path.exists():
-        logging.info("Found image at %s", image_path.name)
-        image_file = image_path.as_posix()
-    else:
-        logging.info("Starting download of image %s", inst_url)
-        image_file = download_image(inst_url, image_path.as_posix())
-
-    logging.info("Starting upload of image into openstack")
-    osp_connection.create_image(image_name, filename=image_file,
-                                container_format="bare", disk_format="qcow2", wait=True,
-                                osia_clusters=cluster_name, visibility='private')
-    logging.info("Upload finished")
-    image = osp_connection.image.find_image(image_name)
-    logging.info("Image uploaded as %s", image.name)
-    with open(Path(cluster_name).joinpath("fips.json"), "w") as fips:
-        obj = {'cloud': cloud, 'fips': [], 'image': image_name}
-        json.dump(obj, fips)
+    image = _upload_image(osp_connection, image_name, cluster_name, images_dir, installer, mode)
+    _update_json(Path(cluster_name).joinpath("fips.json").as_posix(), cloud, image=image_name)
     return image.name
 
 
@@ -184,31 +584,19 @@ def resolve_image(osp_connection: Connection,
                   cluster_name: str,
                   images_dir: str,
                   installer: str,
-                  error: Optional[Exception]):
+                  error: Optional[Exception],
+                  mode: str = None):
     """Function searches for image in openstack and creates it
-    if it doesn't exist"""
-    inst_url, version = get_url(installer)
+    if it doesn't exist.
+
+    Concurrent runs on the same host are serialized by lock file
+    in images directory, runs on different hosts by the image record."""
+    _, version = get_url(installer)
     image_name = f"osia-rhcos-{version}"
-    image = osp_connection.image.find_image(image_name, ignore_missing=True)
-    if image is None:
-        image_path = Path(images_dir).joinpath(f"rhcos-{version}.qcow2")
-        image_file = None
-        if image_path.exists():
-            logging.info("Found image at %s", image_path.name)
-            image_file = image_path.as_posix()
-        else:
-            logging.info("Starting download of image %s", inst_url)
-            image_file = download_image(inst_url, image_path.as_posix())
-
-        logging.info("Starting upload of image into openstack")
-        osp_connection.create_image(image_name, filename=image_file,
-                                    container_format="bare", disk_format="qcow2", wait=True,
-                                    osia_clusters=cluster_name, visibility='private')
-        logging.info("Upload finished")
-        image = osp_connection.image.find_image(image_name)
-        logging.info("Image uploaded as %s", image.name)
-    else:
-        logging.info("Reusing found image in openstack %s", image.name)
+    with file_lock(Path(images_dir).joinpath(f".{image_name}.lock")):
+        image = _shared_image(osp_connection, image_name, cluster_name, images_dir, installer,
+                              mode)
+    if cluster_name not in _image_clusters(image):
         try:
             add_cluster(osp_connection, image, cluster_name)
         except SDKException as err:
@@ -216,10 +604,9 @@ def resolve_image(osp_connection: Connection,
                 raise ImageException("Couldn't add cluster to image") from err
             logging.warning("Image disappeared while metadata were written, trying again")
             logging.debug("Openstack error: %s", err)
-            return resolve_image(osp_connection, cloud, cluster_name, images_dir, installer, err)
-    with open(Path(cluster_name).joinpath("fips.json"), "w") as fips:
-        obj = {'cloud': cloud, 'fips': [], 'image': image_name}
-        json.dump(obj, fips)
+            return resolve_image(osp_connection, cloud, cluster_name, images_dir, installer, err,
+                                 mode)
+    _update_json(Path(cluster_name).joinpath("fips.json").as_posix(), cloud, image=image_name)
     return image.name
 
 
@@ -234,6 +621,9 @@ class OpenstackInstaller(AbstractInstaller):
                  images_dir=None,
                  osp_image_download=False,
                  osp_image_unique=False,
+                 osp_image_stream=None,
+                 osp_image_web_download=False,
+                 osp_fip_pool=False,
                  args=None,
                  **kwargs):
         super().__init__(**kwargs)
@@ -255,42 +645,133 @@ class OpenstackInstaller(AbstractInstaller):
         self.os_image = os_image
         self.image_download = osp_image_download
         self.image_uniq = osp_image_unique
+        self.image_mode = 'web-download' if osp_image_web_download else osp_image_stream
+        self.fip_pool = osp_fip_pool
         self.osp_fip = None
         self.network = None
         self.connection = None
         self.apps_fip = None
+        self.ingress_fip = None
         self.osp_network = None
         self.images_dir = images_dir
+        self.timings = {}
+        self._watcher = None
+        self._installed = threading.Event()
+        self._cancelled = threading.Event()
 
     def get_template_name(self):
         return 'openstack.jinja2'
 
-    def acquire_resources(self):
+    def _connect(self):
         self.connection = _load_connection_openstack(self.osp_cloud)
+
+    def _acquire_network(self):
+        self.network, self.osp_network = _find_fit_network(self.connection, self.network_list)
+        if self.network is None:
+            raise Exception("No suitable network found")
+
+    def _acquire_image(self) -> Optional[str]:
         if self.image_uniq and (self.os_image is None or self.os_image == ""):
             self.os_image = upload_uniq_image(self.connection, self.osp_cloud, self.cluster_name,
-                                              self.images_dir, self.installer)
+                                              self.images_dir, self.installer, self.image_mode)
         elif self.image_download and (self.os_image is None or self.os_image == ""):
             self.os_image = resolve_image(self.connection, self.osp_cloud, self.cluster_name,
-                                          self.images_dir, self.installer, None)
-        self.network, self.osp_network = _find_fit_network(self.connection, self.network_list)
-        if self.network is None:
-            raise Exception("No suitable network found")
-        self.osp_fip = _get_floating_ip(self.connection,
-                                        self.osp_cloud,
-                                        self.network,
-                                        self.cluster_name,
-                                        "api").floating_ip_address
+                                          self.images_dir, self.installer, None,
+                                          self.image_mode)
+        else:
+            return None
+        return self.os_image
+
+    def _release_image(self, image: Optional[str]):
+        if image is not None:
+            delete_image(Path(self.cluster_name).joinpath("fips.json").as_posix(),
+                         self.cluster_name)
+
+    def _acquire_api_fip(self) -> FloatingIP:
+        fip = _get_floating_ip(self.connection, self.osp_cloud, self.network,
+                               self.cluster_name, "api", self.fip_pool)
+        self.osp_fip = fip.floating_ip_address
+        return fip
+
+    def _acquire_ingress_fip(self) -> FloatingIP:
+        self.ingress_fip = _get_floating_ip(self.connection, self.osp_cloud, self.network,
+                                            self.cluster_name, "ingress", self.fip_pool)
+        return self.ingress_fip
+
+    def _release_fip(self, fip: FloatingIP):
+        _release_ip(self.connection, fip)
+
+    def acquire_resources(self):
+        """Resources are acquired concurrently, upload of the image overlaps
+        with selection of the network and allocation of floating ip.
+        If anything fails, already acquired resources are released."""
+        graph = TaskGraph("acquire")
+        graph.add('connect', self._connect)
+        graph.add('network', self._acquire_network, requires=['connect'])
+        graph.add('image', self._acquire_image, requires=['connect'],
+                  release=self._release_image)
+        graph.add('api_fip', self._acquire_api_fip, requires=['network'],
+                  release=self._release_fip)
+        graph.add('ingress_fip', self._acquire_ingress_fip, requires=['network'],
+                  release=self._release_fip)
+        try:
+            graph.run()
+        except Exception:
+            if not graph.unreleased:
+                Path(self.cluster_name).joinpath("fips.json").unlink(missing_ok=True)
+            raise
+        finally:
+            self.timings = graph.timings
+
+    def release_resources(self):
+        fips_file = Path(self.cluster_name).joinpath("fips.json")
+        if not fips_file.exists():
+            return
+        delete_fips(fips_file.as_posix())
+        delete_image(fips_file.as_posix(), self.cluster_name)
+        fips_file.unlink()
+
+    def _attach_ingress_fip(self, ingress_port: Port):
+        _attach_fip_to_port(self.connection, self.ingress_fip, ingress_port)
+        self.apps_fip = self.ingress_fip.floating_ip_address
+        logging.info("Attached floating ip %s to ingress port", self.apps_fip)
+
+    def _watch(self, on_apps_ready):
+        while not self._cancelled.is_set():
+            installed = self._installed.is_set()
+            try:
+                ingress_port = _find_ingress_port(self.connection, self.cluster_name)
+                if ingress_port is not None and not self._cancelled.is_set():
+                    self._attach_ingress_fip(ingress_port)
+                    on_apps_ready(self)
+                    return
+            except Exception as err:  # pylint: disable=broad-except
+                logging.warning("Early attachment of ingress floating ip failed: %s", err)
+                return
+            if installed:
+                return
+            self._installed.wait(INGRESS_POLL)
+
+    def watch_installation(self, on_apps_ready):
+        """Ingress port is polled while the installer runs, the floating ip
+        is attached to it and apps domain registered once the port exists."""
+        self._watcher = threading.Thread(target=contextvars.copy_context().run,
+                                         args=(self._watch, on_apps_ready),
+                                         name=f"osia-ingress-{self.cluster_name}", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._cancelled.set()
+        self._installed.set()
+        if self._watcher is not None:
+            self._watcher.join()
 
     def post_installation(self):
-        ingress_port = _find_cluster_ports(self.connection, self.cluster_name)
-        apps_fip = _get_floating_ip(self.connection,
-                                    self.osp_cloud,
-                                    self.network,
-                                    self.cluster_name,
-                                    "ingress")
-        _attach_fip_to_port(self.connection, apps_fip, ingress_port)
-        self.apps_fip = apps_fip.floating_ip_address
+        self._installed.set()
+        if self._watcher is not None:
+            self._watcher.join()
+        if self.apps_fip is None:
+            self._attach_ingress_fip(_find_cluster_ports(self.connection, self.cluster_name))
 
     def get_api_ip(self) -> Optional[str]:
         return self.osp_fip
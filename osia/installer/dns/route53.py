@@ -14,15 +14,65 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Module implements dns methods to work with route53 provider"""
+from typing import Optional
+import json
 import logging
-import boto3
+import time
 
+from osia.config import get_cache_dir, settings
+from osia.installer.clients import get_client
 from osia.installer.clouds.base import AbstractInstaller
 from osia.installer.dns.base import DNSUtil
+from osia.installer.downloader.utils import file_lock, write_json
+
+ZONE_TTL = 86400
+ZONES_FILE = "route53-zones.json"
 
 
 def _get_connection():
-    return boto3.client('route53')
+    return get_client('route53')
+
+
+def _zones_file():
+    return get_cache_dir() / ZONES_FILE
+
+
+def _load_zones() -> dict:
+    try:
+        with _zones_file().open() as inp:
+            return json.load(inp)
+    except (OSError, ValueError):
+        return {}
+
+
+def _find_hosted_zone(base_domain: str) -> Optional[str]:
+    """Looks up id of the hosted zone by its name, zones are listed
+    ordered by name from the given one on, so single item is enough"""
+    name = base_domain.rstrip('.') + '.'
+    zones = _get_connection().list_hosted_zones_by_name(DNSName=name,
+                                                        MaxItems='1')['HostedZones']
+    if zones and zones[0]['Name'] == name:
+        return zones[0]['Id']
+    return None
+
+
+def get_hosted_zone(base_domain: str, refresh: bool = False) -> str:
+    """Returns id of the hosted zone of base domain. Ids are cached
+    in `route53-zones.json` of the cache directory for `route53_zone_ttl`
+    seconds, so the zone is looked up once per day by default."""
+    ttl = float(settings.get('route53_zone_ttl', ZONE_TTL))
+    with file_lock(_zones_file().with_suffix(".lock")):
+        zones = _load_zones()
+        cached = zones.get(base_domain)
+        if not refresh and cached is not None and time.time() - cached['fetched'] < ttl:
+            logging.debug("Hosted zone cache hit for %s", base_domain)
+            return cached['id']
+        zone_id = _find_hosted_zone(base_domain)
+        if zone_id is None:
+            raise Exception(f"Unable to find hosted_zone {base_domain} in zone list.")
+        zones[base_domain] = {'id': zone_id, 'fetched': time.time()}
+        write_json(_zones_file(), zones)
+    return zone_id
 
 
 class Route53Provider(DNSUtil):
@@ -37,13 +87,9 @@ class Route53Provider(DNSUtil):
     def provider_name(self):
         return 'route53'
 
-    def _get_hosted_zone(self):
-        if self.zone_id is None:
-            zones = _get_connection().list_hosted_zones()['HostedZones']
-            result = [v['Id'] for v in zones if v['Name'] == (self.base_domain + ".")]
-            if len(result) == 0:
-                raise Exception(f"Unable to find hosted_zone {self.base_domain} in zone list.")
-            self.zone_id = result[0]
+    def _get_hosted_zone(self, refresh: bool = False):
+        if self.zone_id is None or refresh:
+            self.zone_id = get_hosted_zone(self.base_domain, refresh)
         return self.zone_id
 
     def _execute_command(self, prefix: str, mode: str, ip_addr: str):
@@ -63,9 +109,15 @@ class Route53Provider(DNSUtil):
         }
         conn = _get_connection()
         try:
-            conn.change_resource_record_sets(
-                HostedZoneId=self._get_hosted_zone(),
-                ChangeBatch=change_batch)
+            try:
+                conn.change_resource_record_sets(
+                    HostedZoneId=self._get_hosted_zone(),
+                    ChangeBatch=change_batch)
+            except conn.exceptions.NoSuchHostedZone:
+                logging.debug("Hosted zone %s is gone, looking it up again", self.zone_id)
+                conn.change_resource_record_sets(
+                    HostedZoneId=self._get_hosted_zone(refresh=True),
+                    ChangeBatch=change_batch)
         except conn.exceptions.InvalidChangeBatch as ex:
             logging.warning("Exception thrown while %s operation, next steps will possibly fail",
                             mode.lower())
@@ -15,7 +15,9 @@
 # limitations under the License.
 """Module implements download logic of resources
 required by installer"""
-from .install import download_installer
-from .image import download_image, get_url
+from .cache import CacheManager
+from .install import download_installer, download_installer_async, PendingInstaller
+from .image import download_image, get_url, get_image_file, open_image
 
-__all__ = ['download_installer', 'download_image', 'get_url']
+__all__ = ['CacheManager', 'download_installer', 'download_installer_async', 'PendingInstaller',
+           'download_image', 'get_url', 'get_image_file', 'open_image']
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Osia authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Module implements size bounded cache of downloaded installers and images.
+
+Every cache directory keeps index of its entries with their sizes and last
+access time, entries are evicted in least recently used order once the
+directory grows over configured budget."""
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import json
+import logging
+import re
+import shutil
+import time
+
+from osia.config import get_section
+from .utils import file_lock, write_json
+
+INDEX_FILE = ".osia-cache.json"
+LOCK_FILE = ".osia-cache.lock"
+
+SIZE_RE = re.compile(r"^\s*(?P<size>\d+(\.\d+)?)\s*(?P<unit>[KMGT]?)i?B?\s*$", re.IGNORECASE)
+UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(size) -> Optional[int]:
+    """Converts size like `20G` or `512M` to number of bytes"""
+    if size is None or isinstance(size, int):
+        return size
+    match = SIZE_RE.match(str(size))
+    if match is None:
+        raise Exception(f"Invalid size {size}, expected number with optional K, M, G or T unit")
+    return int(float(match.group('size')) * UNITS[match.group('unit').upper()])
+
+
+def _entry_size(path: Path) -> int:
+    if path.is_dir():
+        return sum(k.stat().st_size for k in path.rglob('*') if k.is_file())
+    return path.stat().st_size
+
+
+class CacheManager:
+    """Object maintains index of artifacts stored in cache directory.
+
+    The entries are top level items of the directory, i.e. `<version>`
+    directories of installers and `rhcos-<version>.qcow2` images.
+    Installers used by existing cluster directories are pinned and never
+    evicted."""
+    def __init__(self, directory: str, budget: Optional[int] = None):
+        self.directory = Path(directory)
+        if budget is None:
+            budget = parse_size(get_section('downloader').get('cache_budget', None))
+        self.budget = budget
+
+    @contextmanager
+    def _index(self) -> Iterator[Dict]:
+        with file_lock(self.directory / LOCK_FILE):
+            index_path = self.directory / INDEX_FILE
+            index = {'entries': {}, 'pins': {}}
+            if index_path.exists():
+                with index_path.open() as in_stream:
+                    index.update(json.load(in_stream))
+            yield index
+            write_json(index_path, index)
+
+    def _key(self, path: str) -> Optional[str]:
+        try:
+            relative = Path(path).absolute().relative_to(self.directory.absolute())
+        except ValueError:
+            return None
+        return relative.parts[0] if relative.parts else None
+
+    def touch(self, path: str):
+        """Records access to the entry containing path, new entries are
+        added to the index"""
+        key = self._key(path)
+        if key is None:
+            return
+        with self._index() as index:
+            entry = index['entries'].get(key)
+            if entry is None:
+                entry = {'size': _entry_size(self.directory / key)}
+                index['entries'][key] = entry
+                logging.debug("Added %s to cache %s", key, self.directory)
+            entry['atime'] = time.time()
+
+    def pin(self, cluster_name: str, path: str):
+        """Pins the entry containing path, while the cluster directory exists"""
+        key = self._key(path)
+        if key is None:
+            return
+        with self._index() as index:
+            index['pins'].setdefault(cluster_name, [])
+            if key not in index['pins'][cluster_name]:
+                index['pins'][cluster_name].append(key)
+
+    def unpin(self, cluster_name: str):
+        """Removes all pins held by the cluster"""
+        with self._index() as index:
+            index['pins'].pop(cluster_name, None)
+
+    @staticmethod
+    def _live_pins(index: Dict) -> Dict[str, List[str]]:
+        index['pins'] = {k: v for k, v in index['pins'].items() if Path(k).exists()}
+        result: Dict[str, List[str]] = {}
+        for cluster, keys in index['pins'].items():
+            for key in keys:
+                result.setdefault(key, []).append(cluster)
+        return result
+
+    def stats(self) -> List[Dict]:
+        """Returns list of cached entries ordered from the most recently used"""
+        with self._index() as index:
+            pins = self._live_pins(index)
+            index['entries'] = {k: v for k, v in index['entries'].items()
+                                if (self.directory / k).exists()}
+            return [{'name': k, 'size': v['size'], 'atime': v['atime'],
+                     'pinned': pins.get(k, [])}
+                    for k, v in sorted(index['entries'].items(),
+                                       key=lambda i: i[1]['atime'], reverse=True)]
+
+    def prune(self, budget: Optional[int] = None, keep: Optional[str] = None) -> List[str]:
+        """Evicts the least recently used entries until the cache fits into
+        the budget. Returns names of removed entries."""
+        budget = self.budget if budget is None else budget
+        if budget is None:
+            return []
+        keep_key = self._key(keep) if keep is not None else None
+        removed = []
+        with self._index() as index:
+            pins = self._live_pins(index)
+            entries = index['entries']
+            for key in [k for k in entries if not (self.directory / k).exists()]:
+                del entries[key]
+            total = sum(v['size'] for v in entries.values())
+            for key, entry in sorted(entries.items(), key=lambda i: i[1]['atime']):
+                if total <= budget:
+                    break
+                if key in pins or key == keep_key:
+                    continue
+                logging.info("Evicting %s from cache %s", key, self.directory)
+                path = self.directory / key
+                if path.is_dir():
+                    shutil.rmtree(path)
+                else:
+                    path.unlink()
+                total -= entry['size']
+                removed.append(key)
+                del entries[key]
+        if total > budget:
+            logging.warning("Cache %s uses %d bytes, over budget %d, remaining entries are pinned",
+                            self.directory, total, budget)
+        return removed
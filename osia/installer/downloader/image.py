@@ -1,85 +1,42 @@
 """Module implements logic for rhcos image download"""
-import subprocess
-from subprocess import Popen, PIPE
-from shutil import copyfileobj
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Tuple
-from tempfile import NamedTemporaryFile
+from typing import BinaryIO, Iterator, Optional, Tuple
 
 
 import gzip
-import re
 import logging
-import json
 
-import requests
-from .utils import get_data
+from .cache import CacheManager
+from .metadata import get_image_metadata, get_metadata
+from .utils import get_data, open_stream, write_atomic, TeeReader
 
-GITHUB_URL = "https://raw.githubusercontent.com/openshift/installer/{commit}/data/data/rhcos.json"
 
-
-class CoreOsException(Exception):
-    """CoreOsException represents error while executing installer in older version
-    """
-    def __init__(self, *args, **kwargs):
-        super().__init__(self, *args, *kwargs)
-
-
-def _get_coreos_json(installer: str) -> str:
-    json_data = {}
-    with Popen([installer, "coreos", "print-stream-json"], stdout=PIPE,
-               stderr=subprocess.DEVNULL, universal_newlines=True) as proc:
-        proc.wait()
-        if proc.returncode != 0:
-            raise CoreOsException("Installer doesn't support coreos subcommand")
-        json_data = json.loads(proc.stdout.read())
-    json_part = json_data["architectures"]["x86_64"]["artifacts"]["openstack"]
-    release_str = json_part["release"]
-    json_part = json_part["formats"]["qcow2.gz"]
-    return json_part.get("disk", json_part)["location"], release_str
-
-
-def get_commit(installer: str) -> Tuple[str, str]:
+def get_commit(installer: str) -> str:
     """Function extracts source commit from installer,
     in order to find associated rhcos image"""
-    version_str = ""
-    commit_regex = re.compile(r"^.*commit (?P<commit>\w*)$", re.MULTILINE)
-    with Popen([installer, "version"], stdout=PIPE, universal_newlines=True) as proc:
-        version_str = proc.stdout.read()
-    commits = commit_regex.findall(version_str)
-    logging.info("Found commits by running installer %s", commits)
-    return commits[0]
-
-
-def _get_old_url(installer: str) -> Tuple[str, str]:
-    commit = get_commit(installer)
-    gh_data_link = GITHUB_URL.format(commit=commit)
-    rhcos_json = requests.get(gh_data_link, allow_redirects=True)
-    rhcos_data = json.loads(rhcos_json.content)
-    return rhcos_data['baseURI'] + rhcos_data['images']['openstack']['path'], rhcos_data['buildid']
+    return get_metadata(installer)['commit']
 
 
 def get_url(installer: str) -> Tuple[str, str]:
     """Function builds url to rhcos image and version of
     rhcos iamge."""
-    url, version = None, None
-    try:
-        url, version = _get_coreos_json(installer)
-    except CoreOsException as ex:
-        logging.debug(ex)
-        url, version = _get_old_url(installer)
-    return url, version
-
-
-def _extract_gzip(buff: NamedTemporaryFile, target: str) -> Path:
-    result = None
-    with gzip.open(buff.name) as zip_file:
-        result = Path(target)
-        with result.open("wb") as output:
-            copyfileobj(zip_file, output)
+    metadata = get_image_metadata(installer)
+    return metadata['image_url'], metadata['image_release']
+
+
+def _extract_gzip(stream: BinaryIO, target: str) -> Path:
+    result = Path(target)
+    with gzip.GzipFile(fileobj=stream) as zip_file:
+        write_atomic(zip_file, result)
     return result
 
 
+def _existing_image(target: str) -> Optional[Path]:
+    result = Path(target)
+    return result if result.exists() else None
+
+
 def download_image(image_url: str, image_file: str):
     """Main entrypoint for image download, function
     extracts url to rhcos image, downloads and extracts it
@@ -87,10 +44,40 @@ def download_image(image_url: str, image_file: str):
     directory = Path(image_file).parent
     # Check if the directory exists
     if not directory.exists():
-        # If the directory does not exist, create it
-        directory.mkdir(parents=True)
+        # If the directory does not exist, create it, concurrent run may create it too
+        directory.mkdir(parents=True, exist_ok=True)
         logging.debug("Creating %s directory for download images", directory)
     else:
         logging.debug("Directory %s for images already exists", directory)
-    res_file = get_data(image_url, image_file, _extract_gzip)
+    res_file = get_data(image_url, image_file, _extract_gzip, directory.as_posix(),
+                        _existing_image)
     return res_file
+
+
+def get_image_file(image_url: str, version: str, images_dir: str) -> str:
+    """Returns path to rhcos image of the version stored in images
+    directory, the image is downloaded when it is missing"""
+    cache = CacheManager(images_dir)
+    image_path = Path(images_dir).joinpath(f"rhcos-{version}.qcow2")
+    if image_path.exists():
+        logging.info("Found image at %s", image_path.name)
+        cache.touch(image_path.as_posix())
+        return image_path.as_posix()
+    logging.info("Starting download of image %s", image_url)
+    image_file = download_image(image_url, image_path.as_posix())
+    cache.touch(image_file)
+    cache.prune(keep=image_file)
+    return image_file
+
+
+@contextmanager
+def open_image(image_url: str, cache_file: Optional[str] = None) -> Iterator[BinaryIO]:
+    """Opens rhcos image decompressed directly from the http stream.
+    When cache_file is set, the image is stored into it while it is read."""
+    with open_stream(image_url) as stream, gzip.GzipFile(fileobj=stream) as image, \
+            TeeReader(image, cache_file) as result:
+        yield result
+    if cache_file is not None and Path(cache_file).exists():
+        cache = CacheManager(Path(cache_file).parent.as_posix())
+        cache.touch(cache_file)
+        cache.prune(keep=cache_file)
@@ -14,21 +14,26 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Module responsible for download of openshift-install binary"""
-from shutil import copyfileobj
-from tempfile import NamedTemporaryFile
+from concurrent.futures import Future, ThreadPoolExecutor
+from hashlib import sha256
 from pathlib import Path
-from typing import Tuple, Optional
+from typing import BinaryIO, Callable, List, Tuple, Optional
+import contextvars
+import os
 import platform
 
+import json
 import logging
 import re
 import stat
 import tarfile
 import time
-import requests
 
 from bs4 import BeautifulSoup
-from .utils import get_data
+from osia.config import get_section, get_cache_dir
+from osia.config.config import ARCH_AMD, ARCH_X86_64
+from .cache import CacheManager
+from .utils import get_data, get_session, write_atomic, write_json
 
 
 PROD_ROOT = "http://mirror.openshift.com/pub/openshift-v4/{}/clients/ocp/"
@@ -37,7 +42,11 @@ PREVIEW_ROOT = "http://mirror.openshift.com/pub/openshift-v4/{}/clients/ocp-dev-
 
 VERSION_RE = re.compile(r"^openshift-install(-rhel(?P<rhel>\d+))?(-(?P<platform>(linux|mac)))?"
                         r"(-(?P<architecture>\w+))?(-(?P<version>\d+.*))?\.tar\.gz")
+INSTALLER_NAMES = ['openshift-install', 'openshift-install-fips']
 EXTRACTION_RE = re.compile(r'.*Extracting tools for .*, may take up to a minute.*')
+EXACT_VERSION_RE = re.compile(r"^\d+\.\d+\.\d+(-.+)?$")
+LISTING_TTL = 300
+EXTRACTION_TIMEOUT = 600
 
 
 def _current_platform() -> Tuple[str, str]:
@@ -54,6 +63,55 @@ def _current_platform() -> Tuple[str, str]:
     raise Exception(f"Unrecognized platform {platform.system()} {platform.machine()}")
 
 
+def _load_listing(cache_file: Path) -> Optional[dict]:
+    if not cache_file.exists():
+        return None
+    try:
+        with cache_file.open() as in_stream:
+            return json.load(in_stream)
+    except (OSError, ValueError):
+        return None
+
+
+def get_listing(directory: str) -> Tuple[str, List[str]]:
+    """Returns url of the http directory after redirects and links found in it.
+
+    The listing is cached on disk, within `downloader.listing_ttl` seconds
+    it is returned without any request, older listing is revalidated
+    by conditional request."""
+    ttl = int(get_section('downloader').get('listing_ttl', LISTING_TTL))
+    cache_file = get_cache_dir() / "listings" / (sha256(directory.encode()).hexdigest() + ".json")
+    cached = _load_listing(cache_file)
+    if cached is not None and time.time() - cached['fetched'] < ttl:
+        logging.debug('Listing cache hit for %s', directory)
+        return cached['url'], cached['links']
+
+    headers = {}
+    if cached is not None and cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
+    if cached is not None and cached.get('last_modified'):
+        headers['If-Modified-Since'] = cached['last_modified']
+    lst = get_session().get(directory, headers=headers, allow_redirects=True)
+    etag, last_modified = lst.headers.get('ETag'), lst.headers.get('Last-Modified')
+    if cached is not None and lst.status_code == 304:
+        logging.debug('Listing cache revalidated for %s', directory)
+        url, links = cached['url'], cached['links']
+        etag = etag or cached.get('etag')
+        last_modified = last_modified or cached.get('last_modified')
+    else:
+        logging.debug('Listing cache miss for %s', directory)
+        tree = BeautifulSoup(lst.content, 'html.parser')
+        url, links = lst.url, [k.get('href') for k in tree.find_all('a') if k.get('href')]
+        if not lst.ok:
+            return url, links
+    write_json(cache_file, {'url': url,
+                            'links': links,
+                            'etag': etag,
+                            'last_modified': last_modified,
+                            'fetched': time.time()})
+    return url, links
+
+
 def get_url(directory: str, arch: str, fips: bool = False,
             rhel_version: str = None) -> Tuple[Optional[str], Optional[str]]:
     """Searches the http directory and returns both url to installer
@@ -63,27 +121,25 @@ def get_url(directory: str, arch: str, fips: bool = False,
         raise Exception("Rhel version was not detected. Please download installer separatly.")
 
     logging.debug('Url for installers look-up %s', directory)
-    lst = requests.get(directory, allow_redirects=True)
-    tree = BeautifulSoup(lst.content, 'html.parser')
-    links = tree.find_all('a')
+    base_url, links = get_listing(directory)
     installer, version = None, None
     os_name, local_arch = _current_platform()
     for k in links:
-        logging.debug('Parsing link: %s', k.get('href'))
-        match = VERSION_RE.match(k.get('href'))
+        logging.debug('Parsing link: %s', k)
+        match = VERSION_RE.match(k)
 
         if match:
             if match.group("version"):
                 version = match.group('version')
 
             if fips and match.group("rhel") == rhel_version:
-                installer = lst.url + k.get('href')
+                installer = base_url + k
                 break
 
             if not fips and match.group('platform') == os_name:
                 if (local_arch == match.group('architecture')) \
                         or (local_arch == arch and not match.group('architecture')):
-                    installer = lst.url + k.get('href')
+                    installer = base_url + k
                     break
     else:
         if fips:
@@ -92,19 +148,30 @@ def get_url(directory: str, arch: str, fips: bool = False,
     return installer, version
 
 
+def _wait_for_extraction(url: str):
+    conf = get_section('downloader')
+    deadline = time.monotonic() + float(conf.get('extraction_timeout', EXTRACTION_TIMEOUT))
+    delay = 2.0
+    while True:
+        req = get_session().get(url, allow_redirects=True)
+        paragraphs = BeautifulSoup(req.content, 'html.parser').find_all('p')
+        if len(paragraphs) == 0 or not EXTRACTION_RE.search(paragraphs[0].get_text()):
+            return req
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise Exception(f"Installer at {url} was not extracted in time")
+        delay = min(delay * 2, 60.0, remaining)
+        logging.debug('The installer was not extracted yet, waiting for %.0fs', delay)
+        time.sleep(delay)
+
+
 def get_devel_url(version: str, arch: str, fips: bool = False,
                   rhel_version: str = None) -> Tuple[Optional[str], Optional[str]]:
     """
     Searches developement sources and returns url to installer
     """
-    req = requests.get(BUILD_ROOT + version + "/", allow_redirects=True)
-    ast = BeautifulSoup(req.content, 'html.parser')
     logging.info('Checking stage repository for installer')
-    while len(ast.find_all('p')) != 0 and EXTRACTION_RE.match(next(ast.find_all('p')[0].children)):
-        logging.debug('The installer was not extracted yet, waiting for 10s')
-        time.sleep(10)
-        req = requests.get(BUILD_ROOT + version, allow_redirects=True)
-        ast = BeautifulSoup(req.content, 'html.parser')
+    req = _wait_for_extraction(BUILD_ROOT + version + "/")
     logging.debug('Installer found on page, continuing')
     return get_url(req.url, arch, fips, rhel_version)
 
@@ -121,34 +188,40 @@ def get_prod_url(version: str, arch: str, fips: bool = False,
     return get_url(PROD_ROOT.format(arch) + version + "/", arch, fips, rhel_version)
 
 
-def _get_storage_path(version: str, install_base: str) -> str:
-    path = Path(install_base)
-    spec_path = path.joinpath(version)
-    if not spec_path.exists():
-        spec_path.mkdir()
-    return spec_path.as_posix()
+def _storage_name(version: str, arch: str, fips: bool, rhel_version: Optional[str]) -> str:
+    name = version
+    if arch not in [ARCH_AMD, ARCH_X86_64]:
+        name += f"-{arch}"
+    if fips:
+        name += f"-fips-rhel{rhel_version}"
+    return name
 
 
-def _extract_tar(buffer: NamedTemporaryFile, target: str) -> Path:
+def _extract_tar(stream: BinaryIO, target: str) -> Path:
     result = None
-    with tarfile.open(buffer.name) as tar:
-        inst_info = None
-        for i in tar.getmembers():
-            if i.name in ['openshift-install', 'openshift-install-fips']:
-                inst_info = i
-        if inst_info is None:
-            raise Exception("error")
-        stream = tar.extractfile(inst_info)
-        result = Path(target).joinpath(inst_info.name)
-        with result.open('wb') as output:
-            copyfileobj(stream, output)
-        result.chmod(result.stat().st_mode | stat.S_IXUSR)
+    with tarfile.open(fileobj=stream, mode='r|gz') as tar:
+        for member in tar:
+            if member.name in INSTALLER_NAMES:
+                result = Path(target).joinpath(member.name)
+                write_atomic(tar.extractfile(member), result)
+                break
+        else:
+            raise Exception("Installer binary was not found in the archive")
+    result.chmod(result.stat().st_mode | stat.S_IXUSR)
     return result
 
 
+def _existing_installer(target: str) -> Optional[Path]:
+    for name in INSTALLER_NAMES:
+        result = Path(target).joinpath(name)
+        if result.exists():
+            return result
+    return None
+
+
 def get_installer(tar_url: str, target: str):
     """Download and extract the installer into the target"""
-    return get_data(tar_url, target, _extract_tar)
+    return get_data(tar_url, target, _extract_tar, target, _existing_installer)
 
 
 # pylint: disable=too-many-arguments
@@ -172,17 +245,70 @@ def download_installer(installer_version: str,
     else:
         raise Exception("Error for source profile " + source)
 
-    url, version = downloader(installer_version, installer_arch, fips, rhel_version)
-    logging.debug('Installer\'s URL is  %s and full version is %s', url, version)
-    root = Path(dest_directory).joinpath(version)
-
     installer_exe_name = 'openshift-install'
 
     if fips:
         installer_exe_name = 'openshift-install-fips'
 
+    cache = CacheManager(dest_directory)
+    if EXACT_VERSION_RE.match(installer_version):
+        root = Path(dest_directory).joinpath(
+            _storage_name(installer_version, installer_arch, fips, rhel_version))
+        if root.joinpath(installer_exe_name).exists():
+            logging.info('Found installer at %s, skipping look-up on mirror', root.as_posix())
+            cache.touch(root.as_posix())
+            return root.joinpath(installer_exe_name).as_posix()
+
+    url, version = downloader(installer_version, installer_arch, fips, rhel_version)
+    logging.debug('Installer\'s URL is  %s and full version is %s', url, version)
+    root = Path(dest_directory).joinpath(
+        _storage_name(version, installer_arch, fips, rhel_version))
+
     if root.exists() and root.joinpath(installer_exe_name).exists():
         logging.info('Found installer at %s', root.as_posix())
+        cache.touch(root.as_posix())
         return root.joinpath(installer_exe_name).as_posix()
     root.mkdir(parents=True, exist_ok=True)
-    return get_installer(url, root.as_posix())
+    result = get_installer(url, root.as_posix())
+    cache.touch(result)
+    cache.prune(keep=result)
+    return result
+
+
+class PendingInstaller(os.PathLike):
+    """Path to the installer which is being downloaded in background.
+
+    The object can be used in place of the path, the download is joined
+    when the path is accessed for the first time."""
+    def __init__(self, future: Future):
+        self._future = future
+
+    def result(self) -> str:
+        """Waits for the download and returns path to the installer"""
+        return self._future.result()
+
+    def add_done_callback(self, func: Callable[[str], None]):
+        """Calls func with path to the installer once the download succeeds"""
+        def callback(future: Future):
+            if future.exception() is None:
+                func(future.result())
+        self._future.add_done_callback(callback)
+
+    def __fspath__(self) -> str:
+        return self.result()
+
+    def __str__(self) -> str:
+        return self.result()
+
+    def __repr__(self) -> str:
+        state = self.result() if self._future.done() else "downloading"
+        return f"PendingInstaller({state})"
+
+
+def download_installer_async(*args, **kwargs) -> PendingInstaller:
+    """Starts download_installer in background thread, see download_installer
+    for arguments"""
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="osia-installer")
+    future = executor.submit(contextvars.copy_context().run, download_installer, *args, **kwargs)
+    executor.shutdown(wait=False)
+    return PendingInstaller(future)
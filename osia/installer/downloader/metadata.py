@@ -0,0 +1,126 @@
+"""Module implements cache of metadata read from openshift-install binary.
+
+The installer is executed only once per binary, its version and source commit
+are stored next to the binary and reused by all subsequent runs. Location
+of associated rhcos image is resolved only when it is asked for, and it is
+stored separately, so failure of its resolution doesn't affect the version."""
+import subprocess
+from subprocess import Popen, PIPE
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+import json
+import logging
+import re
+import threading
+
+from .utils import get_session, write_json
+
+GITHUB_URL = "https://raw.githubusercontent.com/openshift/installer/{commit}/data/data/rhcos.json"
+METADATA_SUFFIX = ".metadata.json"
+IMAGE_SUFFIX = ".image.json"
+
+_MEMO: Dict[Tuple[str, str], Dict] = {}
+_LOCK = threading.Lock()
+
+
+class CoreOsException(Exception):
+    """CoreOsException represents error while executing installer in older version
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(self, *args, *kwargs)
+
+
+def _get_coreos_json(installer: str) -> Tuple[str, str]:
+    json_data = {}
+    with Popen([installer, "coreos", "print-stream-json"], stdout=PIPE,
+               stderr=subprocess.DEVNULL, universal_newlines=True) as proc:
+        output = proc.stdout.read()
+        proc.wait()
+        if proc.returncode != 0:
+            raise CoreOsException("Installer doesn't support coreos subcommand")
+        json_data = json.loads(output)
+    json_part = json_data["architectures"]["x86_64"]["artifacts"]["openstack"]
+    release_str = json_part["release"]
+    json_part = json_part["formats"]["qcow2.gz"]
+    return json_part.get("disk", json_part)["location"], release_str
+
+
+def _get_version(installer: str) -> Tuple[str, str]:
+    commit_regex = re.compile(r"^.*commit (?P<commit>\w*)$", re.MULTILINE)
+    with Popen([installer, "version"], stdout=PIPE, universal_newlines=True) as proc:
+        version_str = proc.stdout.read()
+    commits = commit_regex.findall(version_str)
+    logging.info("Found commits by running installer %s", commits)
+    return version_str.splitlines()[0].split(' ')[1], commits[0]
+
+
+def _get_old_url(commit: str) -> Tuple[str, str]:
+    gh_data_link = GITHUB_URL.format(commit=commit)
+    rhcos_json = get_session().get(gh_data_link, allow_redirects=True)
+    rhcos_data = json.loads(rhcos_json.content)
+    return rhcos_data['baseURI'] + rhcos_data['images']['openstack']['path'], rhcos_data['buildid']
+
+
+def _probe(installer: str) -> Dict:
+    logging.debug("Reading metadata of installer %s", installer)
+    version, commit = _get_version(installer)
+    return {'version': version, 'commit': commit}
+
+
+def _probe_image(installer: str, commit: str) -> Dict:
+    logging.debug("Reading rhcos image of installer %s", installer)
+    try:
+        image_url, image_release = _get_coreos_json(installer)
+    except CoreOsException as ex:
+        logging.debug(ex)
+        image_url, image_release = _get_old_url(commit)
+    return {'image_url': image_url, 'image_release': image_release}
+
+
+def _load(path: Path) -> Optional[Dict]:
+    if not path.exists():
+        return None
+    try:
+        with path.open() as in_stream:
+            return json.load(in_stream)
+    except (OSError, ValueError):
+        return None
+
+
+def _cached(installer: str, suffix: str, probe: Callable[[str], Dict]) -> Dict:
+    """Returns result of the probe kept in memory and in `<installer><suffix>`,
+    both are invalidated once size or modification time of the binary changes.
+    Failed probe isn't stored and it is run again next time."""
+    path = Path(installer).resolve()
+    stat = path.stat()
+    key = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    with _LOCK:
+        result = _MEMO.get((path.as_posix(), suffix))
+        if result is not None and result['key'] == key:
+            return result
+        store = path.with_name(path.name + suffix)
+        result = _load(store)
+        if result is None or result.get('key') != key:
+            result = probe(path.as_posix())
+            result['key'] = key
+            try:
+                write_json(store, result)
+            except OSError as err:
+                logging.debug("Unable to store metadata of installer, %s", err)
+        else:
+            logging.debug("Using stored metadata of installer %s", installer)
+        _MEMO[(path.as_posix(), suffix)] = result
+        return result
+
+
+def get_metadata(installer: str) -> Dict:
+    """Returns version and commit of the installer"""
+    return _cached(installer, METADATA_SUFFIX, _probe)
+
+
+def get_image_metadata(installer: str) -> Dict:
+    """Returns image_url and image_release of rhcos image associated
+    with the installer"""
+    commit = get_metadata(installer)['commit']
+    return _cached(installer, IMAGE_SUFFIX, lambda k: _probe_image(k, commit))
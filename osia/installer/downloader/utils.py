@@ -1,27 +1,488 @@
 """Module implements utilitary functions shared by download
 package"""
+import contextvars
+import fcntl
+import io
+import json
 import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Callable
+from shutil import copyfileobj
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple
 from tempfile import NamedTemporaryFile
+from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from osia.config import get_section
 
-def get_data(tar_url: str,
-             target: str,
-             processor: Callable[[NamedTemporaryFile, str], Path]) -> str:
-    """Function downloads file via http and runs it through
-    processor function for extraction"""
-    result = None
-    logging.debug('[get_data] Starting the download of %s', tar_url)
-    req = requests.get(tar_url, stream=True, allow_redirects=True)
+BLOCK_SIZE = 1024 * 1024
+QUEUE_DEPTH = 16
+CONNECTIONS = 4
+CHUNK_SIZE = 8 * BLOCK_SIZE
+SAVE_INTERVAL = 1.0
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+Processor = Callable[[BinaryIO, str], Path]
+Finder = Callable[[str], Optional[Path]]
+
+
+class CountingRetry(Retry):
+    """Retry policy which counts and logs retried requests"""
+    retries = 0
+    __lock = threading.Lock()
+
+    def increment(self, method=None, url=None, *args, **kwargs):
+        # pylint: disable=keyword-arg-before-vararg
+        with CountingRetry.__lock:
+            CountingRetry.retries += 1
+        logging.debug('[session] Retrying %s %s, %s', method, url,
+                      kwargs.get('error') or getattr(kwargs.get('response'), 'status', None))
+        return super().increment(method, url, *args, **kwargs)
+
+
+class DownloadSession(requests.Session):
+    """Http session shared by all downloads.
+
+    The session keeps pool of keep-alive connections, retries transient
+    failures with jittered exponential backoff and applies default timeouts.
+    Class implements singleton design pattern."""
+    __instance: "DownloadSession" = None
+    __lock = threading.Lock()
+
+    @classmethod
+    def instance(cls) -> "DownloadSession":
+        """Method to obtain singleton instance."""
+        with cls.__lock:
+            if cls.__instance is None:
+                cls.__instance = cls(get_section('downloader'))
+        return cls.__instance
+
+    def __init__(self, conf: dict):
+        super().__init__()
+        retry = CountingRetry(total=int(conf.get('retries', 5)),
+                              backoff_factor=float(conf.get('backoff_factor', 0.5)),
+                              backoff_jitter=float(conf.get('backoff_jitter', 0.5)),
+                              status_forcelist=RETRY_STATUSES,
+                              allowed_methods=['HEAD', 'GET'],
+                              raise_on_status=False)
+        self.adapter = HTTPAdapter(pool_maxsize=max(int(conf.get('connections', CONNECTIONS)),
+                                                    requests.adapters.DEFAULT_POOLSIZE),
+                                   max_retries=retry)
+        self.mount('http://', self.adapter)
+        self.mount('https://', self.adapter)
+        self.timeout = (float(conf.get('connect_timeout', 10)),
+                        float(conf.get('read_timeout', 60)))
+
+    def request(self, method, url, *args, **kwargs):
+        # pylint: disable=arguments-differ
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, *args, **kwargs)
+
+    def stats(self) -> dict:
+        """Returns number of opened connections, sent requests and retries"""
+        pools = self.adapter.poolmanager.pools
+        pools = [pools[k] for k in list(pools.keys())]
+        return {'connections': sum(k.num_connections for k in pools),
+                'requests': sum(k.num_requests for k in pools),
+                'retries': CountingRetry.retries}
+
+
+def get_session() -> DownloadSession:
+    """Returns http session shared by the downloader package"""
+    return DownloadSession.instance()
+
+
+class StreamReader(io.RawIOBase):
+    """Read-only file object over the body of http response.
+
+    The body is fetched by a background thread into bounded queue,
+    so the network transfer overlaps with the processing (decompression)
+    done by the consumer of the stream."""
+    def __init__(self, response: requests.Response, block_size: int = BLOCK_SIZE):
+        super().__init__()
+        self._response = response
+        self._blocks: queue.Queue = queue.Queue(maxsize=QUEUE_DEPTH)
+        self._stop = threading.Event()
+        self._error = None
+        self._buffer = memoryview(b"")
+        self._eof = False
+        self._thread = threading.Thread(target=contextvars.copy_context().run,
+                                        args=(self._fetch, block_size),
+                                        name="osia-download", daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._blocks.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _fetch(self, block_size: int):
+        try:
+            for block in self._response.iter_content(chunk_size=block_size):
+                if not self._put(block):
+                    return
+        except Exception as err:  # pylint: disable=broad-except
+            self._error = err
+        finally:
+            self._put(None)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buff) -> int:
+        while len(self._buffer) == 0 and not self._eof:
+            block = self._blocks.get()
+            if block is None:
+                self._eof = True
+            else:
+                self._buffer = memoryview(block)
+        if self._eof and self._error is not None:
+            raise self._error
+        size = min(len(buff), len(self._buffer))
+        buff[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._response.close()
+            self._thread.join()
+        super().close()
+
+
+@contextmanager
+def open_stream(url: str) -> Iterator[BinaryIO]:
+    """Opens the url as buffered binary stream, the stream
+    is downloaded by background thread while it is being read."""
+    req = get_session().get(url, stream=True, allow_redirects=True)
+    req.raise_for_status()
+    with io.BufferedReader(StreamReader(req), BLOCK_SIZE) as stream:
+        yield stream
+
+
+class RangeException(Exception):
+    """RangeException represents server which doesn't honor range requests
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(self, *args, **kwargs)
+
+
+def _probe(url: str) -> Tuple[str, Optional[int], bool, Optional[str]]:
+    """Function returns final url after redirects, size of the file,
+    whether the server supports range requests and validator of the file"""
+    try:
+        req = get_session().head(url, allow_redirects=True)
+        req.raise_for_status()
+    except requests.RequestException as err:
+        logging.debug('[get_data] HEAD request failed, %s', err)
+        return url, None, False, None
+    size = req.headers.get('Content-Length')
+    ranges = req.headers.get('Accept-Ranges', 'none').lower() == 'bytes' and \
+        'Content-Encoding' not in req.headers
+    validator = req.headers.get('ETag')
+    if validator is None or validator.startswith('W/'):
+        validator = req.headers.get('Last-Modified')
+    return req.url, int(size) if size else None, ranges, validator
+
+
+class RangedDownload:
+    """Object downloads file by parallel http range requests,
+    every request writes its part into the preallocated file
+    at respective offset.
+
+    If state file is set, the progress of every part is stored in it,
+    so the download can be resumed by later run, as long as the validator
+    (ETag or Last-Modified) of the remote file stays the same. Concurrent
+    runs over the same file must be serialized by the caller."""
+    # pylint: disable=too-many-instance-attributes,too-many-arguments,too-few-public-methods
+    def __init__(self, url: str, path: str, size: int,
+                 connections: int = CONNECTIONS, chunk_size: int = CHUNK_SIZE,
+                 validator: Optional[str] = None, state: Optional[Path] = None):
+        self.url = url
+        self.path = path
+        self.size = size
+        self.connections = connections
+        self.chunk_size = chunk_size
+        self.validator = validator
+        self.state = state
+        self.pieces: List[List[int]] = []
+        self._lock = threading.Lock()
+        self._saved = 0.0
+
+    def _load(self) -> List[List[int]]:
+        fresh = [[start, min(start + self.chunk_size, self.size), start]
+                 for start in range(0, self.size, self.chunk_size)]
+        if self.state is None or self.validator is None or not self.state.exists():
+            return fresh
+        try:
+            saved = json.loads(self.state.read_text())
+        except (OSError, ValueError):
+            return fresh
+        if saved.get('size') != self.size or saved.get('validator') != self.validator:
+            logging.info("Remote file %s changed, discarding partial download", self.url)
+            return fresh
+        done = sum(pos - start for start, _, pos in saved['pieces'])
+        logging.info("Resuming download of %s at %d of %d bytes", self.url, done, self.size)
+        return saved['pieces']
+
+    def _save(self, force: bool = False):
+        if self.state is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._saved < SAVE_INTERVAL:
+                return
+            self._saved = now
+            write_json(self.state, {'size': self.size,
+                                    'validator': self.validator,
+                                    'pieces': self.pieces})
+
+    def _fetch(self, fdesc: int, piece: List[int]):
+        _, end, offset = piece
+        if offset >= end:
+            return
+        headers = {'Range': f'bytes={offset}-{end - 1}'}
+        if self.validator is not None:
+            headers['If-Range'] = self.validator
+        with get_session().get(self.url, headers=headers, stream=True) as req:
+            req.raise_for_status()
+            if req.status_code != 206:
+                raise RangeException(f"Server ignored range request for {self.url}")
+            for block in req.iter_content(chunk_size=BLOCK_SIZE):
+                os.pwrite(fdesc, block, offset)
+                offset += len(block)
+                piece[2] = offset
+                self._save()
+        if offset != end:
+            raise Exception(f"Range {piece[0]}-{end} of {self.url} ended at {offset}")
+        self._save(force=True)
+
+    def run(self):
+        """Starts the download and waits until all parts are written"""
+        fdesc = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            self.pieces = self._load()
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(fdesc, 0, self.size)
+            else:
+                os.truncate(fdesc, self.size)
+            with ThreadPoolExecutor(max_workers=self.connections,
+                                    thread_name_prefix="osia-range") as executor:
+                futures = [executor.submit(contextvars.copy_context().run,
+                                           self._fetch, fdesc, piece)
+                           for piece in self.pieces]
+                done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+                for future in futures:
+                    future.cancel()
+                for future in done:
+                    future.result()
+        finally:
+            self._save(force=True)
+            os.close(fdesc)
+
+
+@contextmanager
+def _locked_file(path: Path) -> Iterator[None]:
+    """Holds exclusive lock of the file, waiting while another run holds it.
+    The previous holder may remove the file, the lock is then taken again
+    on the file which replaced it."""
+    while True:
+        fdesc = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fdesc, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logging.info("Waiting for another download into %s", path)
+                fcntl.flock(fdesc, fcntl.LOCK_EX)
+            try:
+                if os.path.samestat(os.fstat(fdesc), os.stat(path)):
+                    break
+            except FileNotFoundError:
+                pass
+        except BaseException:
+            os.close(fdesc)
+            raise
+        os.close(fdesc)
+    try:
+        yield
+    finally:
+        os.close(fdesc)
+
+
+@contextmanager
+def _partial_file(url: str, work_dir: Optional[str]) -> Iterator[Tuple[str, Optional[Path]]]:
+    if work_dir is None:
+        with NamedTemporaryFile(suffix=".part") as buf:
+            yield buf.name, None
+        return
+    partial = Path(work_dir).joinpath(Path(urlparse(url).path).name + ".part")
+    state = partial.with_name(partial.name + ".json")
+    with _locked_file(partial):
+        yield partial.as_posix(), state
+        partial.unlink(missing_ok=True)
+        state.unlink(missing_ok=True)
+
+
+def _get_ranged(url: str, target: str, processor: Processor, work_dir: Optional[str],
+                conf: dict, existing: Optional[Finder] = None) -> Optional[Path]:
+    # pylint: disable=too-many-arguments,too-many-locals
+    connections = max(int(conf.get('connections', CONNECTIONS)), 1)
+    if connections == 1:
+        logging.debug('[get_data] Single connection configured, using single stream')
+        return None
+    real_url, size, ranges, validator = _probe(url)
+    if not ranges or not size:
+        logging.debug('[get_data] Server does not support ranges, using single stream')
+        return None
+    try:
+        with _partial_file(url, work_dir) as (partial, state):
+            result = existing(target) if existing is not None else None
+            if result is not None:
+                logging.info('%s was downloaded by another run, using %s', url, result)
+                return result
+            logging.debug('[get_data] Downloading %d bytes over %d connections into %s',
+                          size, connections, partial)
+            RangedDownload(real_url, partial, size, connections=connections,
+                           chunk_size=int(conf.get('chunk_size', CHUNK_SIZE)),
+                           validator=validator, state=state).run()
+            logging.debug('[get_data] Download finished, starting extraction')
+            with open(partial, 'rb') as stream:
+                return processor(stream, target)
+    except RangeException as err:
+        logging.debug('[get_data] Falling back to single stream, %s', err)
+        return None
+
+
+def _get_buffered(url: str, target: str, processor: Processor) -> Path:
+    req = get_session().get(url, stream=True, allow_redirects=True)
+    req.raise_for_status()
     with NamedTemporaryFile() as buf:
-        for block in req.iter_content(chunk_size=4096):
+        for block in req.iter_content(chunk_size=BLOCK_SIZE):
             buf.write(block)
         buf.flush()
+        buf.seek(0)
         logging.debug('[get_data] Download finished, starting extraction')
-        result = processor(buf, target)
+        return processor(buf, target)
+
+
+def get_data(tar_url: str,
+             target: str,
+             processor: Processor,
+             work_dir: Optional[str] = None,
+             existing: Optional[Finder] = None) -> str:
+    """Function downloads file via http and runs it through
+    processor function for extraction.
+
+    If the server supports range requests and `downloader.connections`
+    is more than one, the file is downloaded over that many parallel
+    connections into partial file in `work_dir`. Interrupted download is resumed by the next call.
+    Concurrent downloads of the same file wait for each other, the waiting
+    one calls `existing` with the target and reuses the returned result.
+    Otherwise the body is streamed directly into the processor, unless
+    `downloader.streaming` is disabled in settings, then the whole
+    file is stored to temporary file first."""
+    conf = get_section('downloader')
+    logging.debug('[get_data] Starting the download of %s', tar_url)
+    result = _get_ranged(tar_url, target, processor, work_dir, conf, existing)
+    if result is None and conf.get('streaming', True):
+        with open_stream(tar_url) as stream:
+            result = processor(stream, target)
+    elif result is None:
+        result = _get_buffered(tar_url, target, processor)
 
     logging.debug('[get_data] File extracted to %s', result.as_posix())
+    logging.debug('[get_data] Session totals: %s', get_session().stats())
     return result.as_posix()
+
+
+def _tmp_path(path: Path) -> Path:
+    """Returns name of temporary file next to the path, which is unique
+    for the writing process and thread."""
+    return path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def write_atomic(stream: BinaryIO, target: Path):
+    """Copies stream to the target file, the file appears
+    at its location only once all the data are written."""
+    tmp = _tmp_path(target)
+    try:
+        with tmp.open("wb") as output:
+            copyfileobj(stream, output, BLOCK_SIZE)
+        tmp.replace(target)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+class TeeReader(io.RawIOBase):
+    """Non-seekable reader over another stream, which optionally copies
+    the read data into target file. The target file appears only once
+    the source stream was read to its end."""
+    def __init__(self, source: BinaryIO, target: Optional[str] = None):
+        super().__init__()
+        self._source = source
+        self._target = Path(target) if target is not None else None
+        self._tee = None
+        self._eof = False
+        if self._target is not None:
+            self._target.parent.mkdir(parents=True, exist_ok=True)
+            # pylint: disable=consider-using-with
+            self._tee = _tmp_path(self._target).open("wb")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buff) -> int:
+        data = self._source.read(len(buff))
+        if not data:
+            self._eof = True
+            return 0
+        if self._tee is not None:
+            self._tee.write(data)
+        buff[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed and self._tee is not None:
+            self._tee.close()
+            tmp = Path(self._tee.name)
+            if self._eof:
+                tmp.replace(self._target)
+            else:
+                tmp.unlink(missing_ok=True)
+        super().close()
+
+
+def write_json(path: Path, obj):
+    """Stores object as json, readers never see partially written file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = _tmp_path(path)
+    with tmp.open("w") as out:
+        json.dump(obj, out)
+    tmp.replace(path)
+
+
+@contextmanager
+def file_lock(path: Path) -> Iterator[None]:
+    """Holds exclusive lock of the file for the duration of the context,
+    the lock synchronizes concurrent runs of osia on the same host."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a") as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
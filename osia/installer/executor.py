@@ -18,10 +18,19 @@ from os import environ
 from subprocess import Popen
 from pathlib import Path
 import logging
+import shutil
+import threading
+import time
 
+from osia.config import settings
 from .clouds import InstallerProvider
-from .clouds.openstack import delete_fips, delete_image
+from .clouds.openstack import delete_fips, delete_image, sweep_cluster
 from .dns import DNSProvider
+from .downloader import CacheManager, PendingInstaller
+from .tasks import TaskGraph
+
+DESTROY_TIMEOUT = 3600
+DESTROY_BACKOFF = 30
 
 
 class InstallerExecutionException(Exception):
@@ -30,74 +39,165 @@ class InstallerExecutionException(Exception):
         super().__init__(self, *args, **kwargs)
 
 
-def execute_installer(installer, base_path, operation, os_image=None):
-    """Function executes actual installation of OpenShift"""
+def execute_installer(installer, base_path, operation, os_image=None, output=None):
+    """Function executes actual installation of OpenShift,
+    output of the installer is written to the output stream if it is set"""
     additional_env = None
     if os_image is not None and os_image:
         additional_env = environ.copy()
         additional_env.update({'OPENSHIFT_INSTALL_OS_IMAGE_OVERRIDE': os_image})
     with Popen([installer, operation, 'cluster', '--dir', base_path],
-               env=additional_env, universal_newlines=True) as proc:
+               env=additional_env, universal_newlines=True,
+               stdout=output, stderr=output) as proc:
         proc.wait()
         if proc.returncode != 0:
             raise InstallerExecutionException("Failed execution of installer")
 
 
+def _release_resources(inst, dns_prov, cluster_path: Path):
+    """Frees resources of the installation which failed before the installer
+    started, cluster directory is removed once everything is released."""
+    graph = TaskGraph("release", keep_going=True)
+    if dns_prov is not None:
+        graph.add('dns', dns_prov.delete_domains)
+    graph.add('resources', inst.release_resources)
+    graph.run()
+    for task, error in graph.errors.items():
+        logging.error("Release of %s of %s failed: %s", task, cluster_path.name, error)
+    if graph.errors:
+        logging.warning("Keeping %s, the remaining resources must be removed manually",
+                        cluster_path.as_posix())
+        return
+    shutil.rmtree(cluster_path)
+
+
+def _pin_installer(installers_dir, cluster_name, installer):
+    """Pins the installer in the cache while the cluster directory exists,
+    installer downloaded in background is pinned once it is available."""
+    cache = CacheManager(installers_dir)
+    if isinstance(installer, PendingInstaller):
+        installer.add_done_callback(lambda path: cache.pin(cluster_name, path))
+    else:
+        cache.pin(cluster_name, installer)
+
+
 def install_cluster(cloud_provider,
                     cluster_name, configuration,
                     installer,
-                    dns_settings=None):
+                    dns_settings=None,
+                    output=None,
+                    installers_dir=None) -> bool:
     """Function represents main entrypoint to all logic necessary for
-    cluster's deployment."""
+    cluster's deployment. Returns whether the cluster was installed.
+    Installer from `installers_dir` cache is pinned for the lifetime of the cluster."""
     # pylint: disable=too-many-arguments
     cluster_path = Path("./") / cluster_name
     if cluster_path.exists():
         logging.error("Path %s already exists, remove it before continuing",
                       cluster_path.as_posix())
-        return
+        return False
     cluster_path.mkdir()
+    if installers_dir is not None:
+        _pin_installer(installers_dir, cluster_name, installer)
     inst = InstallerProvider.instance()[cloud_provider](cluster_name=cluster_name, **configuration)
-    inst.acquire_resources()
     dns_prov = None
-    if dns_settings is not None:
-        dns_prov = DNSProvider.instance()[dns_settings['provider']](**dns_settings['conf'])
-        dns_prov.add_api_domain(inst)
-        dns_prov.marshall(cluster_name)
+    try:
+        inst.acquire_resources()
+        if dns_settings is not None:
+            dns_prov = DNSProvider.instance()[dns_settings['provider']](**dns_settings['conf'])
+            dns_prov.add_api_domain(inst)
+            dns_prov.marshall(cluster_name)
 
-    inst.process_template()
+        inst.process_template()
+    except Exception:
+        _release_resources(inst, dns_prov, cluster_path)
+        raise
 
+    apps_ready = threading.Event()
+
+    def register_apps(instance):
+        if dns_prov is not None:
+            dns_prov.add_apps_domain(instance)
+            dns_prov.marshall(cluster_name)
+        apps_ready.set()
+
+    inst.watch_installation(register_apps)
     try:
         execute_installer(installer, cluster_name, 'create',
-                          os_image=getattr(inst, 'os_image', None))
+                          os_image=getattr(inst, 'os_image', None), output=output)
     except InstallerExecutionException as exception:
         logging.error(exception)
+        inst.stop_watching()
         if inst.check_clean():
-            delete_cluster(cluster_name, installer)
+            delete_cluster(cluster_name, installer, output=output)
         # Do not continue in case of installer failure
-        return
+        return False
 
     inst.post_installation()
 
-    if dns_settings is not None:
-        dns_prov.add_apps_domain(inst)
-        dns_prov.marshall(cluster_name)
+    # apps domain wasn't registered while the installer was running
+    if not apps_ready.is_set():
+        register_apps(inst)
+    return True
 
 
-def delete_cluster(cluster_name, installer):
+def _destroy_cluster(cluster_name, installer, output=None):
+    """Runs installer's destroy until it succeeds or `destroy_timeout`
+    from settings elapses, attempts are delayed by exponential backoff."""
+    deadline = time.monotonic() + float(settings.get('destroy_timeout', DESTROY_TIMEOUT))
+    delay = DESTROY_BACKOFF
+    attempt = 1
+    while True:
+        try:
+            logging.debug("Attempt to clean #%d", attempt)
+            execute_installer(installer, cluster_name, 'destroy', output=output)
+            return
+        except InstallerExecutionException as exception:
+            if time.monotonic() + delay > deadline:
+                raise
+            logging.error("Re-executing installer in %ds due to error %s", delay, exception)
+            time.sleep(delay)
+            delay = min(delay * 2, 10 * DESTROY_BACKOFF)
+            attempt += 1
+
+
+def _sweep_cluster(fips_file, cluster_name):
+    try:
+        sweep_cluster(fips_file, cluster_name)
+    except Exception as err:  # pylint: disable=broad-except
+        logging.warning("Sweep of %s failed, leaving resources to installer: %s",
+                        cluster_name, err)
+
+
+def delete_cluster(cluster_name, installer, output=None, sweep=False):
     """Function is the controller of all actions leading to the
-    cluster's deletion."""
+    cluster's deletion.
+
+    Removal of dns records, floating ips and image runs concurrently
+    with installer's destroy. Failure of destroy is only reported,
+    other failures are raised once all actions finished.
+    With sweep set, openstack resources of the cluster are deleted
+    in bulk before the destroy."""
     dns_prov = DNSProvider.instance().load(cluster_name)
-    if dns_prov is not None:
-        dns_prov.delete_domains()
     fips_file = Path(cluster_name) / "fips.json"
+    graph = TaskGraph("teardown", keep_going=True)
+    if dns_prov is not None:
+        graph.add('dns', dns_prov.delete_domains)
     if fips_file.exists():
-        delete_fips(fips_file)
-        delete_image(fips_file, cluster_name)
+        graph.add('fips', lambda: delete_fips(fips_file))
+        graph.add('image', lambda: delete_image(fips_file, cluster_name))
+    destroy_requires = []
+    if sweep and fips_file.exists():
+        graph.add('sweep', lambda: _sweep_cluster(fips_file, cluster_name))
+        destroy_requires.append('sweep')
+    graph.add('destroy', lambda: _destroy_cluster(cluster_name, installer, output),
+              requires=destroy_requires)
+    graph.run()
+    for task, outcome in graph.report().items():
+        logging.info("Teardown of %s: %s %s", cluster_name, task, outcome)
+    if fips_file.exists() and 'fips' not in graph.errors and 'image' not in graph.errors:
         fips_file.unlink()
-    for k in [1, 2]:
-        try:
-            logging.debug("Attempt to clean #%d", k)
-            execute_installer(installer, cluster_name, 'destroy')
-            break
-        except InstallerExecutionException as exception:
-            logging.error("Re-executing installer due to error %s", exception)
+    failed = [k for k in graph.errors if k != 'destroy']
+    if failed:
+        raise InstallerExecutionException(f"Teardown of {cluster_name} failed in "
+                                          f"{', '.join(failed)}")
@@ -20,8 +20,11 @@ Module is responsible for maintenance of the git repository
 and to store the generated artifacts by the `openshift-install
 binary."""
 import logging
+import threading
 from git import Repo
 
+_LOCK = threading.RLock()
+
 
 def check_repository():
     """Function checks local repository if it is up2date with
@@ -30,17 +33,21 @@ def check_repository():
     local copy it tries to pull from remote.
 
     It returns the Repo object and remote associated with
-    current tracking branch."""
-    rep = Repo("./")
-    remote = rep.active_branch.tracking_branch()
-    if remote:
-        fetches = rep.remotes[remote.remote_name].fetch()
-        for fetch in fetches:
-            if fetch.name == remote.name and fetch.commit != rep.commit():
-                logging.warning("There are changes in remote repository, trying to pull")
-                rep.remotes[remote.remote_name].pull()
-    if rep.is_dirty():
-        logging.warning("There are not committed changes in your repository, please fix this")
+    current tracking branch.
+
+    Operations over the repository are serialized, so the concurrent
+    installations don't interfere with each other."""
+    with _LOCK:
+        rep = Repo("./")
+        remote = rep.active_branch.tracking_branch()
+        if remote:
+            fetches = rep.remotes[remote.remote_name].fetch()
+            for fetch in fetches:
+                if fetch.name == remote.name and fetch.commit != rep.commit():
+                    logging.warning("There are changes in remote repository, trying to pull")
+                    rep.remotes[remote.remote_name].pull()
+        if rep.is_dirty():
+            logging.warning("There are not committed changes in your repository, please fix this")
 
     return rep, remote
 
@@ -49,20 +56,22 @@ def write_changes(cluster_directory):
     """Function stages generated directory, which contains files
     generated by openshift-install function, creates commit,
     and pushes to the remote of tracking branch."""
-    rep, remote = check_repository()
-    rep.index.add(cluster_directory)
-    logging.info("Commiting installer changes for cluster %s", cluster_directory)
-    rep.index.commit(f"[OCP Installer] installation files for {cluster_directory} added")
-    if remote:
-        rep.remotes[remote.remote_name].push()
+    with _LOCK:
+        rep, remote = check_repository()
+        rep.index.add(cluster_directory)
+        logging.info("Commiting installer changes for cluster %s", cluster_directory)
+        rep.index.commit(f"[OCP Installer] installation files for {cluster_directory} added")
+        if remote:
+            rep.remotes[remote.remote_name].push()
 
 
 def delete_directory(cluster_directory):
     """Function deletes commited directory both
     from local copy and from the remote repository."""
-    rep, remote = check_repository()
-    logging.info("Removing cluster directory from git repository %s", cluster_directory)
-    rep.index.remove(cluster_directory, working_tree=True, r=True, f=True)
-    rep.index.commit(f"[OCP Installer] removed installation files for {cluster_directory}")
-    if remote:
-        rep.remotes[remote.remote_name].push()
+    with _LOCK:
+        rep, remote = check_repository()
+        logging.info("Removing cluster directory from git repository %s", cluster_directory)
+        rep.index.remove(cluster_directory, working_tree=True, r=True, f=True)
+        rep.index.commit(f"[OCP Installer] removed installation files for {cluster_directory}")
+        if remote:
+            rep.remotes[remote.remote_name].push()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Osia authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Module implements execution of dependent tasks on thread pool.
+
+Task starts as soon as all tasks it requires are finished, so independent
+branches of the graph run at the same time."""
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import contextvars
+import logging
+import time
+
+WORKERS = 4
+
+
+class Task:
+    """Single unit of work of the graph. Release function gets
+    the result of the task and frees what the task has acquired."""
+    # pylint: disable=too-few-public-methods
+    def __init__(self, name: str, func: Callable[[], Any], requires: Sequence[str] = (),
+                 release: Optional[Callable[[Any], None]] = None):
+        self.name = name
+        self.func = func
+        self.requires = list(requires)
+        self.release = release
+
+
+class TaskGraph:
+    """Object runs tasks in order given by their dependencies
+    and records duration of every task.
+
+    When any task fails, no other task is started, the running ones are
+    awaited and the finished tasks are released in reverse order.
+    Tasks which failed to be released are listed in `unreleased`.
+
+    With `keep_going` set, failure of the task skips only the tasks which
+    require it, errors are collected in `errors` instead of being raised."""
+    def __init__(self, name: str, workers: int = WORKERS, keep_going: bool = False):
+        self.name = name
+        self.workers = workers
+        self.keep_going = keep_going
+        self.tasks: Dict[str, Task] = {}
+        self.timings: Dict[str, float] = {}
+        self.errors: Dict[str, Exception] = {}
+        self.unreleased: List[str] = []
+
+    def add(self, name: str, func: Callable[[], Any], requires: Sequence[str] = (),
+            release: Optional[Callable[[Any], None]] = None) -> "TaskGraph":
+        """Adds task to the graph, required tasks must be added before"""
+        missing = [k for k in requires if k not in self.tasks]
+        if missing:
+            raise Exception(f"Task {name} requires unknown tasks {', '.join(missing)}")
+        self.tasks[name] = Task(name, func, requires, release)
+        return self
+
+    def _timed(self, task: Task) -> Any:
+        start = time.monotonic()
+        try:
+            return task.func()
+        finally:
+            self.timings[task.name] = time.monotonic() - start
+            logging.debug("[%s] Task %s finished in %.1fs", self.name, task.name,
+                          self.timings[task.name])
+
+    def _release(self, finished: List[Task], results: Dict[str, Any]):
+        for task in reversed(finished):
+            if task.release is None:
+                continue
+            logging.info("[%s] Releasing %s", self.name, task.name)
+            try:
+                task.release(results[task.name])
+            except Exception as err:  # pylint: disable=broad-except
+                logging.error("[%s] Release of %s failed: %s", self.name, task.name, err)
+                self.unreleased.append(task.name)
+
+    def run(self) -> Dict[str, Any]:
+        """Runs all tasks and returns their results by task name"""
+        results: Dict[str, Any] = {}
+        finished: List[Task] = []
+        pending = dict(self.tasks)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers,
+                                thread_name_prefix=f"osia-{self.name}") as executor:
+            while pending or running:
+                ready = [k for k in pending.values()
+                         if (self.keep_going or not self.errors) and
+                         all(j in results for j in k.requires)]
+                for task in ready:
+                    del pending[task.name]
+                    running[executor.submit(contextvars.copy_context().run,
+                                            self._timed, task)] = task
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    try:
+                        results[task.name] = future.result()
+                        finished.append(task)
+                    except Exception as err:  # pylint: disable=broad-except
+                        logging.error("[%s] Task %s failed: %s", self.name, task.name, err)
+                        self.errors[task.name] = err
+        logging.info("[%s] Tasks took %s", self.name,
+                     ", ".join(f"{k} {v:.1f}s" for k, v in self.timings.items()))
+        if self.errors and not self.keep_going:
+            self._release(finished, results)
+            raise next(iter(self.errors.values()))
+        return results
+
+    def report(self) -> Dict[str, str]:
+        """Returns outcome of every task of the last run"""
+        result = {}
+        for name in self.tasks:
+            if name in self.errors:
+                result[name] = f"failed after {self.timings[name]:.1f}s: {self.errors[name]}"
+            elif name in self.timings:
+                result[name] = f"done in {self.timings[name]:.1f}s"
+            else:
+                result[name] = "skipped"
+        return result
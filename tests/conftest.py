@@ -0,0 +1,286 @@
+"""Fixtures shared by the tests"""
+import gzip
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from urllib.request import urlopen
+
+import pytest
+from openstack.connection import Connection
+
+from osia.installer.downloader import utils
+
+RANGE_RE = re.compile(r"bytes=(\d+)-(\d+)")
+
+
+def timed(func):
+    """Returns result of the function and number of seconds it took"""
+    start = time.monotonic()
+    result = func()
+    return result, time.monotonic() - start
+
+
+class Concurrency:
+    """Context manager wrapping calls of fake service, `peak` is the most
+    calls seen in flight at once"""
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        return self
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self.active -= 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "FileServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _headers(self, status: int, length: int, extra=None):
+        self.send_response(status)
+        self.send_header('Content-Length', str(length))
+        self.send_header('ETag', self.server.etag)
+        if self.server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        for key, value in (extra or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+
+    def do_HEAD(self):
+        data = self.server.files.get(self.path.lstrip('/'))
+        if data is None:
+            self.send_error(404)
+            return
+        self._headers(200, len(data))
+
+    def do_GET(self):
+        data = self.server.files.get(self.path.lstrip('/'))
+        if data is None:
+            self.send_error(404)
+            return
+        match = RANGE_RE.match(self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        if match and self.server.ranges and self.server.honor_ranges and \
+                (if_range is None or if_range == self.server.etag):
+            start, end = int(match.group(1)), int(match.group(2))
+            if self.server.fail_from is not None and start >= self.server.fail_from:
+                self.send_error(404)
+                return
+            self._headers(206, end - start + 1,
+                          {'Content-Range': f"bytes {start}-{end}/{len(data)}"})
+            body = data[start:end + 1]
+        else:
+            self._headers(200, len(data))
+            body = data
+        self.server.record(self.headers.get('Range'), len(body))
+        for offset in range(0, len(body), 64 * 1024):
+            self.wfile.write(body[offset:offset + 64 * 1024])
+            if self.server.delay:
+                time.sleep(self.server.delay)
+
+
+class FileServer(ThreadingHTTPServer):
+    """Http server serving files from memory. It announces range support
+    unless `ranges` is unset, `honor_ranges` unset makes it ignore the
+    requested ranges, `fail_from` fails ranges starting from the offset."""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.files = {}
+        self.etag = '"1"'
+        self.ranges = True
+        self.honor_ranges = True
+        self.fail_from = None
+        self.delay = 0.0
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def record(self, range_header, sent: int):
+        """Records served GET request"""
+        with self._lock:
+            self.requests.append((range_header, sent))
+
+    def sent(self) -> int:
+        """Returns number of body bytes served by GET requests"""
+        return sum(k[1] for k in self.requests)
+
+    def url(self, name: str) -> str:
+        """Returns url of the served file"""
+        return f"http://127.0.0.1:{self.server_port}/{name}"
+
+
+@pytest.fixture
+def file_server():
+    """Runs FileServer in background thread"""
+    server = FileServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def downloader_conf(monkeypatch):
+    """Settings of `downloader` section, the shared session is created
+    again with them"""
+    conf = {'retries': 0, 'chunk_size': 256 * 1024, 'connections': 4}
+    monkeypatch.setattr(utils, 'get_section', lambda name: conf)
+    monkeypatch.setattr(utils.DownloadSession, '_DownloadSession__instance', None)
+    return conf
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """Points shared osia caches to temporary directory"""
+    monkeypatch.setenv('XDG_CACHE_HOME', tmp_path.joinpath('xdg').as_posix())
+    return tmp_path.joinpath('xdg', 'osia')
+
+
+class _GlanceHandler(BaseHTTPRequestHandler):
+    server: "FakeGlance"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status: int, obj=None):
+        body = json.dumps(obj).encode() if obj is not None else b""
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self) -> bytes:
+        if self.headers.get('Transfer-Encoding', '').lower() != 'chunked':
+            return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        data = b""
+        while True:
+            size = int(self.rfile.readline().split(b";")[0], 16)
+            chunk = self.rfile.read(size + 2)
+            if size == 0:
+                return data
+            data += chunk[:-2]
+
+    def _image(self):
+        match = re.match(r"^/v2/images/([^/?]+)", self.path)
+        return self.server.images.get(match.group(1)) if match else None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/v2/info/import':
+            self._json(200, {'import-methods': {'type': 'array',
+                                                'value': self.server.import_methods}})
+        elif url.path == '/v2/images':
+            names = parse_qs(url.query).get('name')
+            self._json(200, {'images': [k for k in self.server.images.values()
+                                        if names is None or k['name'] in names]})
+        elif url.path.startswith('/v2/images/'):
+            image = self._image()
+            self._json(200, image) if image is not None else self._json(404)
+        else:
+            self._json(200, {'versions': [{'id': 'v2.9', 'status': 'CURRENT', 'links': [
+                {'rel': 'self', 'href': f"http://127.0.0.1:{self.server.server_port}/v2/"}]}]})
+
+    def do_POST(self):
+        body = self._body()
+        if self.path == '/v2/images':
+            self._json(201, self.server.create(json.loads(body)))
+        elif self.path.endswith('/import'):
+            image = self._image()
+            method = json.loads(body)['method']
+            self.server.imports.append(method)
+            with urlopen(method['uri']) as response:
+                self.server.store(image, response.read(), self.server.decompress)
+            self._json(202)
+        else:
+            self._json(404)
+
+    def do_PUT(self):
+        image = self._image()
+        if image is None:
+            self._json(404)
+        elif '/tags/' in self.path:
+            image['tags'].append(self.path.rsplit('/', 1)[1])
+            self._json(204)
+        elif self.server.reject_upload:
+            self.close_connection = True
+            self._json(413)
+        else:
+            self.server.store(image, self._body())
+            self._json(204)
+
+    def do_DELETE(self):
+        image = self._image()
+        if image is not None and '/tags/' in self.path:
+            image['tags'].remove(self.path.rsplit('/', 1)[1])
+        elif image is not None:
+            self.server.deleted.append(self.server.images.pop(image['id'])['name'])
+        self._json(204)
+
+
+class FakeGlance(ThreadingHTTPServer):
+    """Image service keeping images in memory. Images imported by web-download
+    are decompressed only with `decompress` set, uploads are refused with
+    `reject_upload` set. Gzipped data are not recognized as qcow2, such image
+    has no virtual size."""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _GlanceHandler)
+        self.images = {}
+        self.data = {}
+        self.imports = []
+        self.deleted = []
+        self.import_methods = ['glance-direct', 'web-download']
+        self.decompress = True
+        self.reject_upload = False
+
+    def create(self, attrs: dict) -> dict:
+        """Creates image record in queued state"""
+        image = dict(attrs, id=str(uuid.uuid4()), status='queued', size=None,
+                     virtual_size=None, tags=attrs.get('tags', []),
+                     created_at=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
+        self.images[image['id']] = image
+        return image
+
+    def store(self, image: dict, data: bytes, decompress: bool = False):
+        """Stores data of the image and activates it"""
+        if decompress:
+            data = gzip.decompress(data)
+        self.data[image['id']] = data
+        image.update(status='active', size=len(data),
+                     virtual_size=None if data[:2] == b"\x1f\x8b" else len(data))
+
+    def connect(self) -> Connection:
+        """Returns openstack connection to the service"""
+        url = f"http://127.0.0.1:{self.server_port}"
+        return Connection(auth_type='none', auth={'endpoint': url},
+                          image_endpoint_override=url + "/v2/")
+
+
+@pytest.fixture
+def glance():
+    """Runs FakeGlance in background thread"""
+    server = FakeGlance()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
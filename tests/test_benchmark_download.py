@@ -0,0 +1,80 @@
+"""Benchmark of streaming download and extraction against the download
+into temporary file, run with `pytest -s -m benchmark` to see the numbers"""
+import gzip
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+import pytest
+
+from osia.installer.downloader import download_image
+
+SIZE = 32 * 1024 * 1024
+
+
+def _dir_size(path: Path) -> int:
+    total = 0
+    for item in path.iterdir():
+        try:
+            total += item.stat().st_size
+        except FileNotFoundError:
+            pass
+    return total
+
+
+def _measure(func, tmp_dir: Path):
+    """Returns wall time, peak of python allocations and peak size
+    of temporary directory during the call"""
+    peak_tmp = 0
+    done = threading.Event()
+
+    def watch():
+        nonlocal peak_tmp
+        while not done.is_set():
+            peak_tmp = max(peak_tmp, _dir_size(tmp_dir))
+            time.sleep(0.005)
+
+    watcher = threading.Thread(target=watch, daemon=True)
+    watcher.start()
+    tracemalloc.start()
+    start = time.monotonic()
+    try:
+        func()
+    finally:
+        elapsed = time.monotonic() - start
+        _, peak_mem = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        done.set()
+        watcher.join()
+    return elapsed, peak_mem, peak_tmp
+
+
+@pytest.mark.benchmark
+def test_streaming_against_temporary_file(file_server, downloader_conf, tmp_path, monkeypatch):
+    image = os.urandom(SIZE // 2) + bytes(SIZE // 2)
+    file_server.files['rhcos.qcow2.gz'] = gzip.compress(image)
+    downloader_conf['connections'] = 1
+    file_server.delay = 0.0005
+    tmp_dir = tmp_path.joinpath('tmp')
+    tmp_dir.mkdir()
+    monkeypatch.setattr(tempfile, 'tempdir', tmp_dir.as_posix())
+
+    results = {}
+    for streaming in [False, True]:
+        downloader_conf['streaming'] = streaming
+        target = tmp_path.joinpath(f"streaming-{streaming}", 'rhcos.qcow2')
+        results[streaming] = _measure(
+            lambda: download_image(file_server.url('rhcos.qcow2.gz'), target.as_posix()),
+            tmp_dir)
+        assert target.read_bytes() == image
+
+    print()
+    for streaming, (elapsed, peak_mem, peak_tmp) in results.items():
+        print(f"{'streaming' if streaming else 'temporary file':15} {elapsed:6.2f}s, "
+              f"peak memory {peak_mem / 2 ** 20:6.1f} MiB, "
+              f"peak temporary files {peak_tmp / 2 ** 20:6.1f} MiB")
+    assert results[True][2] == 0
+    assert results[False][2] >= len(file_server.files['rhcos.qcow2.gz'])
@@ -0,0 +1,116 @@
+"""Benchmark of port and network look-ups against fake Neutron holding
+10k ports, run with `pytest -s -m benchmark` to see the numbers"""
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import Concurrency, timed
+from osia.installer.clouds import openstack
+
+PORTS = 10000
+NETWORKS = 50
+LATENCY = 0.02
+ITEM_COST = 0.00002
+WANTED = ['net-7', 'net-21', 'net-33', 'net-48']
+
+
+class FakeNeutron:
+    """Connection answering every request after latency, which grows with
+    the number of returned items, filters are applied by the server"""
+    def __init__(self):
+        self.calls = []
+        self.in_flight = Concurrency()
+        self._lock = threading.Lock()
+        self.ports = [SimpleNamespace(id=f"port-{k}", name=f"cluster{k // 50}-infra-{k % 50}")
+                      for k in range(PORTS)]
+        self.ports.append(SimpleNamespace(id="ingress", name="cluster77-x7k2p-ingress-port"))
+        self.networks = [SimpleNamespace(id=f"id-{k}", name=f"net-{k}") for k in range(NETWORKS)]
+        self.network = SimpleNamespace(
+            ports=lambda name: self._answer('ports', [k for k in self.ports if k.name == name]),
+            networks=lambda name: self._answer('networks',
+                                               [k for k in self.networks if k.name == name]),
+            get_network_ip_availability=self._availability)
+
+    def _answer(self, call: str, items):
+        with self._lock:
+            self.calls.append(call)
+        with self.in_flight:
+            time.sleep(LATENCY + ITEM_COST * len(items))
+        return items
+
+    def _availability(self, network_id: str):
+        index = int(network_id.split('-')[1])
+        return self._answer('availability', [SimpleNamespace(subnet_ip_availability=[
+            {'ip_version': 4, 'total_ips': 256, 'used_ips': 10 + index},
+            {'ip_version': 6, 'total_ips': 2 ** 64, 'used_ips': 1}])])[0]
+
+    def list_ports(self):
+        """Lists ports of the project without filters"""
+        return self._answer('list_ports', self.ports)
+
+    def list_networks(self):
+        """Lists networks of the project without filters"""
+        return [{'id': k.id, 'name': k.name}
+                for k in self._answer('list_networks', self.networks)]
+
+
+def _client_side_ports(connection, cluster_name):
+    """Look-up filtering all ports of the project on the client"""
+    return next(iter([k for k in connection.list_ports()
+                      if k.name.startswith(cluster_name) and k.name.endswith('ingress-port')]))
+
+
+def _client_side_network(connection, networks):
+    """Look-up listing all networks and querying availability one by one"""
+    named = {k['name']: k for k in connection.list_networks() if k['name'] in networks}
+    results = {}
+    for name in networks:
+        avail = connection.network.get_network_ip_availability(named[name]['id'])
+        usage = [(k['total_ips'], k['used_ips'])
+                 for k in avail.subnet_ip_availability if k['ip_version'] == 4]
+        total_ips, used_ips = [sum(i) for i in zip(*usage)]
+        results[name] = total_ips / used_ips
+    result = max(results.items(), key=lambda k: k[1])[0]
+    return named[result]['id'], result
+
+
+@pytest.fixture
+def neutron(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tmp_path.joinpath('cluster77').mkdir()
+    tmp_path.joinpath('cluster77', 'metadata.json').write_text(
+        json.dumps({'infraID': 'cluster77-x7k2p'}))
+    monkeypatch.setattr(openstack, '_AVAILABILITY', {})
+    return FakeNeutron()
+
+
+@pytest.mark.benchmark
+def test_ingress_port_lookup(neutron):
+    expected, client_side = timed(lambda: _client_side_ports(neutron, 'cluster77'))
+    neutron.calls.clear()
+    port, server_side = timed(lambda: openstack._find_cluster_ports(neutron, 'cluster77'))
+
+    print(f"\ningress port among {PORTS} ports: client side filter {client_side:.3f}s, "
+          f"server side filter {server_side:.3f}s")
+    assert port.id == expected.id == 'ingress'
+    assert neutron.calls == ['ports']
+
+
+@pytest.mark.benchmark
+def test_network_lookup(neutron):
+    expected, client_side = timed(lambda: _client_side_network(neutron, WANTED))
+    neutron.calls.clear()
+    neutron.in_flight.peak = 0
+    result, server_side = timed(lambda: openstack._find_fit_network(neutron, WANTED))
+    assert neutron.calls.count('availability') == len(WANTED)
+    assert neutron.in_flight.peak > 1
+    neutron.calls.clear()
+    _, cached = timed(lambda: openstack._find_fit_network(neutron, WANTED))
+
+    print(f"\nbest of {len(WANTED)} networks: sequential {client_side:.3f}s, "
+          f"concurrent {server_side:.3f}s, with cached availability {cached:.3f}s")
+    assert result == expected == ('id-7', 'net-7')
+    assert 'availability' not in neutron.calls
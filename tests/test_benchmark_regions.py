@@ -0,0 +1,120 @@
+"""Benchmark of aws region selection against stubbed EC2 with latency
+of every call, run with `pytest -s -m benchmark` to see the numbers"""
+import threading
+import time
+
+import boto3
+import pytest
+
+from conftest import Concurrency, timed
+from osia.installer import clients
+from osia.installer.clouds import aws
+
+REGIONS = [f"region-{k}" for k in range(16)]
+VPCS = {k: 5 for k in REGIONS}
+VPCS.update({'region-12': 1, 'region-14': 3})
+LATENCY = 0.05
+FIRST_CLIENT = 0.1
+CLIENT = 0.01
+QUOTAS = {'L-F678F1CE': 5, 'L-0263D0A3': 5, 'L-FE5A380F': 5, 'L-1216C47A': 1000}
+
+
+class _Paginator:
+    def __init__(self, client, key):
+        self.client = client
+        self.key = key
+
+    def paginate(self, **unused_kwargs):
+        self.client.call()
+        return [{self.key: [], 'Reservations': []}]
+
+
+class StubClient:
+    """Client of ec2 or service-quotas, every call takes the latency"""
+    class exceptions:
+        """Exceptions raised by the client"""
+        NoSuchResourceException = type('NoSuchResourceException', (Exception,), {})
+
+    def __init__(self, session, region):
+        self.session = session
+        self.region = region
+
+    def call(self):
+        """Records the call and waits for the answer"""
+        self.session.record()
+        with self.session.in_flight:
+            time.sleep(LATENCY)
+
+    def describe_regions(self):
+        self.call()
+        return {'Regions': [{'RegionName': k} for k in REGIONS]}
+
+    def describe_vpcs(self):
+        self.call()
+        return {'Vpcs': [{}] * VPCS[self.region]}
+
+    def describe_addresses(self):
+        self.call()
+        return {'Addresses': []}
+
+    def get_paginator(self, operation):
+        return _Paginator(self, {'describe_nat_gateways': 'NatGateways'}.get(operation, 'Items'))
+
+    def get_service_quota(self, ServiceCode, QuotaCode):
+        self.call()
+        return {'Quota': {'Value': QUOTAS[QuotaCode], 'ServiceCode': ServiceCode}}
+
+
+class StubSession:
+    """Session whose first client of the service loads the service model,
+    later clients of the service are cheaper"""
+    def __init__(self):
+        self.calls = 0
+        self.loaded = set()
+        self.in_flight = Concurrency()
+        self._lock = threading.Lock()
+
+    def record(self):
+        """Counts the call of any client"""
+        with self._lock:
+            self.calls += 1
+
+    def client(self, service, region_name=None):
+        """Constructs client of the service"""
+        time.sleep(CLIENT if service in self.loaded else FIRST_CLIENT)
+        self.loaded.add(service)
+        return StubClient(self, region_name)
+
+
+def _sequential(session, candidates):
+    """Region selection probing regions one by one until first free one"""
+    if len(candidates) == 0:
+        candidates = [k['RegionName'] for k in session.client('ec2').describe_regions()['Regions']]
+    for candidate in candidates:
+        if len(session.client('ec2', candidate).describe_vpcs()['Vpcs']) < 5:
+            return candidate
+    return None
+
+
+@pytest.fixture
+def session(monkeypatch):
+    stub = StubSession()
+    monkeypatch.setattr(boto3.session, 'Session', lambda: stub)
+    monkeypatch.setattr(clients.AWSClients, '_AWSClients__instance', None)
+    return stub
+
+
+@pytest.mark.benchmark
+@pytest.mark.usefixtures('cache_dir')
+@pytest.mark.parametrize('candidates', [REGIONS, []], ids=['listed', 'all'])
+def test_region_selection(session, candidates):
+    expected, sequential = timed(lambda: _sequential(StubSession(), candidates))
+    result, parallel = timed(lambda: aws.get_free_region(candidates))
+    session.calls = 0
+    cached_result, cached = timed(lambda: aws.get_free_region(candidates))
+
+    print(f"\n{len(REGIONS)} regions: one by one {sequential:.2f}s, "
+          f"all at once {parallel:.2f}s, from cache {cached:.3f}s")
+    assert result == expected == cached_result == 'region-12'
+    assert session.in_flight.peak > 1
+    assert session.calls == 0
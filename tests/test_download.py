@@ -0,0 +1,131 @@
+"""Tests of ranged, resumable and concurrent downloads"""
+import gzip
+import json
+import os
+import threading
+from pathlib import Path
+
+import pytest
+import requests
+
+from osia.installer.downloader import download_image
+from osia.installer.downloader.utils import get_data, write_atomic
+
+SIZE = 2 * 1024 * 1024 + 1234
+
+
+def _store(stream, target: str) -> Path:
+    result = Path(target)
+    write_atomic(stream, result)
+    return result
+
+
+@pytest.fixture
+def payload(file_server):
+    data = os.urandom(SIZE)
+    file_server.files['blob.bin'] = data
+    return data
+
+
+def test_ranged_download(file_server, downloader_conf, payload, tmp_path):
+    result = get_data(file_server.url('blob.bin'), tmp_path.joinpath('out').as_posix(),
+                      _store, tmp_path.as_posix())
+
+    assert Path(result).read_bytes() == payload
+    chunks = -(-SIZE // downloader_conf['chunk_size'])
+    assert len(file_server.requests) == chunks
+    assert all(k[0] is not None for k in file_server.requests)
+    assert sorted(os.listdir(tmp_path)) == ['out']
+
+
+def test_fallback_without_ranges(file_server, downloader_conf, payload, tmp_path):
+    file_server.ranges = False
+    result = get_data(file_server.url('blob.bin'), tmp_path.joinpath('out').as_posix(),
+                      _store, tmp_path.as_posix())
+
+    assert Path(result).read_bytes() == payload
+    assert file_server.requests == [(None, SIZE)]
+
+
+@pytest.mark.parametrize('streaming', [True, False])
+def test_single_connection(file_server, downloader_conf, payload, tmp_path, streaming):
+    downloader_conf.update(connections=1, streaming=streaming)
+    result = get_data(file_server.url('blob.bin'), tmp_path.joinpath('out').as_posix(),
+                      _store, tmp_path.as_posix())
+
+    assert Path(result).read_bytes() == payload
+    assert file_server.requests == [(None, SIZE)]
+
+
+def test_fallback_when_ranges_ignored(file_server, downloader_conf, payload, tmp_path):
+    file_server.honor_ranges = False
+    result = get_data(file_server.url('blob.bin'), tmp_path.joinpath('out').as_posix(),
+                      _store, tmp_path.as_posix())
+
+    assert Path(result).read_bytes() == payload
+    assert file_server.requests[-1] == (None, SIZE)
+
+
+def _interrupted(file_server, tmp_path):
+    file_server.fail_from = SIZE // 2
+    with pytest.raises(requests.HTTPError):
+        get_data(file_server.url('blob.bin'), tmp_path.joinpath('out').as_posix(),
+                 _store, tmp_path.as_posix())
+    file_server.fail_from = None
+    state = json.loads(tmp_path.joinpath('blob.bin.part.json').read_text())
+    assert sum(pos - start for start, _, pos in state['pieces']) > 0
+    file_server.requests.clear()
+
+
+def test_resume(file_server, downloader_conf, payload, tmp_path):
+    _interrupted(file_server, tmp_path)
+
+    result = get_data(file_server.url('blob.bin'), tmp_path.joinpath('out').as_posix(),
+                      _store, tmp_path.as_posix())
+
+    assert Path(result).read_bytes() == payload
+    assert file_server.sent() < SIZE
+    assert sorted(os.listdir(tmp_path)) == ['out']
+
+
+def test_resume_discarded_after_validator_change(file_server, downloader_conf, payload,
+                                                 tmp_path):
+    _interrupted(file_server, tmp_path)
+    changed = os.urandom(SIZE)
+    file_server.files['blob.bin'] = changed
+    file_server.etag = '"2"'
+
+    result = get_data(file_server.url('blob.bin'), tmp_path.joinpath('out').as_posix(),
+                      _store, tmp_path.as_posix())
+
+    assert Path(result).read_bytes() == changed
+    assert file_server.sent() == SIZE
+
+
+@pytest.mark.parametrize('ranges', [True, False])
+def test_concurrent_downloads(file_server, downloader_conf, tmp_path, ranges):
+    image = os.urandom(SIZE)
+    file_server.files['rhcos.qcow2.gz'] = gzip.compress(image)
+    file_server.ranges = ranges
+    file_server.delay = 0.01
+    target = tmp_path.joinpath('img', 'rhcos.qcow2')
+    errors = []
+
+    def run():
+        try:
+            download_image(file_server.url('rhcos.qcow2.gz'), target.as_posix())
+        except Exception as err:
+            errors.append(err)
+
+    threads = [threading.Thread(target=run) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert target.read_bytes() == image
+    assert sorted(os.listdir(target.parent)) == ['rhcos.qcow2']
+    if ranges:
+        # waiting runs reuse the image downloaded by the first one
+        assert file_server.sent() == len(file_server.files['rhcos.qcow2.gz'])
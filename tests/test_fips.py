@@ -0,0 +1,55 @@
+"""Tests of release of cluster floating ips"""
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from osia.installer.clouds import openstack
+
+
+class FakeNetwork:
+    """Network service filtering floating ips by the query"""
+    def __init__(self, fips):
+        self.fips = fips
+        self.queries = []
+        self.deleted = []
+
+    def ips(self, **filters):
+        self.queries.append(filters)
+        assert filters, "floating ips must be queried with filter"
+        return [k for k in self.fips if all(getattr(k, j) == v for j, v in filters.items())]
+
+    def delete_ip(self, fip):
+        self.deleted.append(fip.floating_ip_address)
+
+
+def _fip(address, description, tags=None):
+    return SimpleNamespace(floating_ip_address=address, description=description, tags=tags)
+
+
+@pytest.fixture
+def network(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tmp_path.joinpath('cluster1').mkdir()
+    tmp_path.joinpath('cluster1', 'fips.json').write_text(json.dumps(
+        {'cloud': 'test', 'fips': ['10.0.0.1', '10.0.0.2', '10.0.0.3']}))
+    fake = FakeNetwork([
+        _fip('10.0.0.1', 'cluster1-api'),
+        _fip('10.0.0.2', 'cluster1-ingress'),
+        # allocated by older osia, without description
+        _fip('10.0.0.3', None),
+        # cluster of the same name managed from another repository
+        _fip('10.0.0.4', 'cluster1-api'),
+        _fip('10.0.0.5', 'cluster2-api'),
+    ])
+    monkeypatch.setattr(openstack, '_load_connection_openstack',
+                        lambda name: SimpleNamespace(network=fake))
+    return fake
+
+
+def test_delete_recorded_fips(network):
+    openstack.delete_fips('cluster1/fips.json')
+
+    assert sorted(network.deleted) == ['10.0.0.1', '10.0.0.2', '10.0.0.3']
+    assert {'floating_ip_address': '10.0.0.3'} in network.queries
+    assert len(network.queries) == len(openstack.FIP_PURPOSES) + 1
@@ -0,0 +1,100 @@
+"""Tests of rhcos image upload against fake Glance"""
+import gzip
+import json
+import os
+
+import pytest
+
+from osia.installer.clouds import openstack
+
+VERSION = "4.16.1"
+IMAGE = os.urandom(1024 * 1024)
+
+
+@pytest.fixture
+def images(tmp_path, monkeypatch, file_server, glance, downloader_conf):
+    monkeypatch.chdir(tmp_path)
+    tmp_path.joinpath('cluster1').mkdir()
+    file_server.files['rhcos.qcow2.gz'] = gzip.compress(IMAGE)
+    monkeypatch.setattr(openstack, 'get_url',
+                        lambda installer: (file_server.url('rhcos.qcow2.gz'), VERSION))
+    return tmp_path.joinpath('images')
+
+
+def _upload(glance, images, mode):
+    return openstack.upload_uniq_image(glance.connect(), 'test', 'cluster1',
+                                       images.as_posix(), 'installer', mode)
+
+
+@pytest.mark.parametrize('mode', ['stream', 'cache'])
+def test_streamed_upload(glance, images, mode):
+    name = _upload(glance, images, mode)
+
+    image, = glance.images.values()
+    assert image['name'] == name == f"osia-cluster1-{VERSION}"
+    assert image['status'] == 'active'
+    assert glance.data[image['id']] == IMAGE
+    assert json.loads(open('cluster1/fips.json').read())['image'] == name
+    cached = images.joinpath(f"rhcos-{VERSION}.qcow2")
+    if mode == 'cache':
+        assert cached.read_bytes() == IMAGE
+    else:
+        assert not cached.exists()
+
+
+@pytest.mark.parametrize('mode', ['stream', 'cache'])
+def test_failed_upload(glance, images, mode):
+    glance.reject_upload = True
+
+    with pytest.raises(Exception):
+        _upload(glance, images, mode)
+
+    assert glance.images == {}
+    assert glance.deleted == [f"osia-cluster1-{VERSION}"]
+    # glance may refuse the data only after the whole image was read
+    left = list(images.iterdir()) if images.exists() else []
+    assert all(k.name == f"rhcos-{VERSION}.qcow2" and k.read_bytes() == IMAGE for k in left)
+
+
+@pytest.mark.parametrize('mode', ['stream', 'cache'])
+def test_truncated_download(glance, images, file_server, mode):
+    file_server.files['rhcos.qcow2.gz'] = gzip.compress(IMAGE)[:512 * 1024]
+
+    with pytest.raises(Exception):
+        _upload(glance, images, mode)
+
+    assert glance.images == {}
+    assert glance.deleted == [f"osia-cluster1-{VERSION}"]
+    assert not images.exists() or list(images.iterdir()) == []
+
+
+def test_web_download_import(glance, images, file_server):
+    _upload(glance, images, 'web-download')
+
+    image, = glance.images.values()
+    assert image['status'] == 'active'
+    assert glance.data[image['id']] == IMAGE
+    assert [k['uri'] for k in glance.imports] == [file_server.url('rhcos.qcow2.gz')]
+    assert not images.exists()
+
+
+def test_web_download_unsupported(glance, images):
+    glance.import_methods = ['glance-direct']
+
+    _upload(glance, images, 'web-download')
+
+    image, = glance.images.values()
+    assert glance.imports == []
+    assert glance.data[image['id']] == IMAGE
+    assert images.joinpath(f"rhcos-{VERSION}.qcow2").read_bytes() == IMAGE
+
+
+def test_web_download_without_decompression(glance, images):
+    glance.decompress = False
+
+    with pytest.raises(openstack.ImageException):
+        _upload(glance, images, 'web-download')
+
+    assert len(glance.imports) == 1
+    assert glance.images == {}
+    assert glance.deleted == [f"osia-cluster1-{VERSION}"]
@@ -0,0 +1,60 @@
+"""Tests of installer metadata, the installer is a script recording
+its invocations"""
+import json
+import stat
+
+import pytest
+
+from osia.installer.downloader import image, metadata
+
+STREAM = {'architectures': {'x86_64': {'artifacts': {'openstack': {
+    'release': '416.94', 'formats': {'qcow2.gz': {'disk': {'location': 'http://rhcos'}}}}}}}}
+SCRIPT = """#!/bin/sh
+echo "$@" >> {calls}
+if [ "$1" = version ]; then
+    printf 'openshift-install 4.16.1\\nbuilt from commit abc123\\n'
+elif [ -e {stream} ]; then
+    cat {stream}
+else
+    exit 1
+fi
+"""
+
+
+@pytest.fixture
+def installer(tmp_path, monkeypatch):
+    monkeypatch.setattr(metadata, '_MEMO', {})
+    path = tmp_path.joinpath('openshift-install')
+    path.write_text(SCRIPT.format(calls=tmp_path / 'calls', stream=tmp_path / 'stream.json'))
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    return path
+
+
+def _calls(installer):
+    return installer.with_name('calls').read_text().splitlines()
+
+
+def test_version_without_image(installer, monkeypatch):
+    def unreachable(commit):
+        raise ConnectionError(f"rhcos.json of {commit} not reachable")
+    monkeypatch.setattr(metadata, '_get_old_url', unreachable)
+
+    assert metadata.get_metadata(installer.as_posix())['version'] == '4.16.1'
+    assert _calls(installer) == ['version']
+    with pytest.raises(ConnectionError):
+        image.get_url(installer.as_posix())
+    assert metadata.get_metadata(installer.as_posix())['commit'] == 'abc123'
+    assert _calls(installer) == ['version', 'coreos print-stream-json']
+
+
+def test_image_cached_separately(installer):
+    installer.with_name('stream.json').write_text(json.dumps(STREAM))
+
+    assert image.get_url(installer.as_posix()) == ('http://rhcos', '416.94')
+    metadata._MEMO.clear()
+    assert image.get_url(installer.as_posix()) == ('http://rhcos', '416.94')
+    assert metadata.get_metadata(installer.as_posix())['version'] == '4.16.1'
+
+    assert _calls(installer) == ['version', 'coreos print-stream-json']
+    assert installer.with_name('openshift-install.metadata.json').exists()
+    assert installer.with_name('openshift-install.image.json').exists()
@@ -0,0 +1,145 @@
+"""Tests of bulk sweep of openstack resources, against mocked sdk
+with injected latency of every call"""
+import json
+import logging
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from openstack.exceptions import SDKException
+
+from osia.batch import BatchInstaller
+from osia.installer.clouds import openstack
+
+LATENCY = 0.05
+INFRA_ID = "cluster1-x7k2p"
+OTHER_ID = "cluster2-a1b2c"
+ORDER = ['load balancers', 'servers', 'ports', 'volumes', 'security groups']
+
+
+def _resource(kind: str, infra_id: str, index: int, **kwargs):
+    tag = f"openshiftClusterID={infra_id}"
+    return SimpleNamespace(id=f"{kind}-{infra_id}-{index}", kind=kind, tags=[tag], **kwargs)
+
+
+class FakeCloud:
+    """Connection holding resources of two clusters, every call sleeps
+    for the latency and deletions are recorded with their time"""
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.deleted = []
+        self.failing = set()
+        self._lock = threading.Lock()
+        self.resources = []
+        for infra_id in [INFRA_ID, OTHER_ID]:
+            self.resources += [_resource('load balancers', infra_id, k,
+                                         name=f"kube_service_{infra_id}_ns_svc{k}")
+                               for k in range(3)]
+            self.resources += [_resource('servers', infra_id, k, name=f"{infra_id}-master-{k}")
+                               for k in range(6)]
+            self.resources += [_resource('ports', infra_id, k, device_owner='compute:nova')
+                               for k in range(12)]
+            self.resources += [_resource('ports', infra_id, 'router',
+                                         device_owner='network:router_interface')]
+            self.resources += [_resource('volumes', infra_id, k,
+                                         metadata={'cinder.csi.openstack.org/cluster': infra_id})
+                               for k in range(6)]
+            self.resources += [_resource('security groups', infra_id, k) for k in range(2)]
+        self.load_balancer = SimpleNamespace(
+            load_balancers=lambda: self._list('load balancers'),
+            delete_load_balancer=lambda k, **kw: self._delete(k))
+        self.compute = SimpleNamespace(
+            servers=lambda name: [k for k in self._list('servers') if re.match(name, k.name)],
+            delete_server=lambda k, **kw: self._delete(k),
+            wait_for_delete=lambda k, **kw: time.sleep(self.latency))
+        self.network = SimpleNamespace(
+            ports=lambda tags: [k for k in self._list('ports') if tags in k.tags],
+            delete_port=lambda k, **kw: self._delete(k),
+            security_groups=lambda tags: [k for k in self._list('security groups')
+                                          if tags in k.tags],
+            delete_security_group=lambda k, **kw: self._delete(k))
+        self.block_storage = SimpleNamespace(
+            volumes=lambda: self._list('volumes'),
+            delete_volume=lambda k, **kw: self._delete(k))
+
+    def _list(self, kind: str):
+        time.sleep(self.latency)
+        return [k for k in self.resources if k.kind == kind]
+
+    def _delete(self, resource):
+        start = time.monotonic()
+        time.sleep(self.latency)
+        if resource.id in self.failing:
+            raise SDKException(f"Unable to delete {resource.id}")
+        with self._lock:
+            self.resources.remove(resource)
+            self.deleted.append((resource.kind, resource.id, start, time.monotonic()))
+        logging.info("Deleted %s", resource.id)
+
+
+@pytest.fixture
+def cloud(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cluster = tmp_path.joinpath('cluster1')
+    cluster.mkdir()
+    cluster.joinpath('metadata.json').write_text(json.dumps({'infraID': INFRA_ID}))
+    cluster.joinpath('fips.json').write_text(json.dumps({'cloud': 'test', 'fips': []}))
+    fake = FakeCloud(LATENCY)
+    monkeypatch.setattr(openstack, '_load_connection_openstack', lambda name: fake)
+    return fake
+
+
+def test_sweep_deletes_cluster_resources(cloud):
+    openstack.sweep_cluster('cluster1/fips.json', 'cluster1')
+
+    remaining = [k.id for k in cloud.resources if INFRA_ID in k.id]
+    assert remaining == [f"ports-{INFRA_ID}-router"]
+    assert all(OTHER_ID not in k[1] for k in cloud.deleted)
+
+
+def test_sweep_in_dependency_order(cloud):
+    openstack.sweep_cluster('cluster1/fips.json', 'cluster1')
+
+    for earlier, later in zip(ORDER, ORDER[1:]):
+        finished = max(k[3] for k in cloud.deleted if k[0] == earlier)
+        started = min(k[2] for k in cloud.deleted if k[0] == later)
+        assert finished <= started, f"{later} deleted before {earlier}"
+
+
+def test_sweep_deletes_concurrently(cloud):
+    openstack.sweep_cluster('cluster1/fips.json', 'cluster1')
+
+    for kind in ORDER:
+        deleted = [k for k in cloud.deleted if k[0] == kind]
+        assert any(j[2] < k[3] and k[2] < j[3] for j in deleted for k in deleted if j is not k), \
+            f"{kind} deleted one by one"
+
+
+def test_sweep_continues_after_failure(cloud):
+    cloud.failing = {f"servers-{INFRA_ID}-0", f"volumes-{INFRA_ID}-1"}
+
+    openstack.sweep_cluster('cluster1/fips.json', 'cluster1')
+
+    remaining = sorted(k.id for k in cloud.resources if INFRA_ID in k.id)
+    assert remaining == sorted(cloud.failing | {f"ports-{INFRA_ID}-router"})
+
+
+def test_sweep_without_metadata(cloud, tmp_path):
+    tmp_path.joinpath('cluster1', 'metadata.json').unlink()
+
+    openstack.sweep_cluster('cluster1/fips.json', 'cluster1')
+
+    assert cloud.deleted == []
+
+
+def test_sweep_logged_to_cluster_log(cloud, tmp_path, caplog):
+    caplog.set_level(logging.INFO)
+    batch = BatchInstaller({'clusters': [{'cluster_name': 'cluster1'}],
+                            'log_dir': tmp_path.joinpath('logs').as_posix()})
+
+    batch.run(lambda cluster, output: openstack.sweep_cluster('cluster1/fips.json', 'cluster1'))
+
+    log = tmp_path.joinpath('logs', 'cluster1.log').read_text()
+    assert all(f"Deleted {k[1]}" in log for k in cloud.deleted)